@@ -0,0 +1,211 @@
+"""Benchmarks on lib* modules.
+
+Unlike speedtesting.py, these are targeted timings. Run them like:
+    python benchmark.py            # run everything
+    python benchmark.py lookup     # run bench_lookup only"""
+
+import os
+import sys
+import tracemalloc
+from tempfile import mkdtemp
+from timeit import timeit
+
+from libinventory import FixedSizeArray, ItemRegistry, LinkedFSA, null
+from libshared import PUID, Protocol, invalidate_paths
+
+
+def bench_lookup(block_size: int = 10, number: int = 20000):
+    """Inventory slot lookup should stay flat as block count grows."""
+    print("== LinkedFSA.smart_get (per lookup) ==")
+    for blocks in (1, 10, 100, 1000):
+        lfsa = LinkedFSA(*(FixedSizeArray(block_size, True)
+                         for _ in range(blocks)))
+        last = lfsa.size - 1
+        t = timeit(lambda: lfsa.smart_get(last), number=number)
+        print(f"blocks={blocks:<5} {t/number*1e6:8.3f} us")
+
+
+def bench_write(number: int = 20000):
+    """A single slot write should cost the same on any array size."""
+    print("== FixedSizeArray insert+pop (per write) ==")
+    for size in (10_000, 100_000, 1_000_000):
+        fsa = FixedSizeArray(size, True)
+        index = size // 2
+
+        def write():
+            fsa.insert(index, 'item')
+            fsa.pop(index)
+        t = timeit(write, number=number)
+        print(f"size={size:<8} {t/number/2*1e6:8.3f} us")
+
+
+class _DictLayoutFSA:
+    """Per-instance layout of FixedSizeArray before __slots__ (for bench_memory)"""
+
+    def __init__(self, size: int):
+        self._size = size
+        self._array = [null]*size
+        self._address_UUID = PUID.make_random()
+        self._address = self._address_UUID.body.upper()
+        self._noalloc = True
+        self._name = None
+        self._owner = None
+
+
+class _Item:
+    """Hashable stand-in of ItemType"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.key = ('item', name)
+
+
+def _traced(build):
+    """Return bytes allocated by build() and still alive"""
+    tracemalloc.start()
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def bench_memory(blocks: int = 2000, block_size: int = 50):
+    """Memory of many small blocks, each holding some items."""
+    items = [_Item(f'item-{i}') for i in range(block_size)]
+
+    def old():
+        x = [_DictLayoutFSA(block_size) for _ in range(blocks)]
+        for fsa in x:
+            fsa._array[:len(items)//2] = items[:len(items)//2]
+        return x
+
+    def new(registry=None):
+        def build():
+            x = [FixedSizeArray(block_size, True, registry)
+                 for _ in range(blocks)]
+            for fsa in x:
+                fsa._load(items[:len(items)//2])
+            return x
+        return build
+    print(f"== {blocks} blocks of {block_size} slots ==")
+    for name, build in (("dict layout", old), ("slots", new()), ("slots+typed", new(ItemRegistry()))):
+        print(f"{name:<12} {_traced(build)/blocks:10.1f} bytes/block")
+
+
+def bench_puid(n: int = 1_000_000):
+    """Generate and compare n PUIDs."""
+    print(f"== {n} PUID ==")
+    t = timeit(lambda: [PUID.make_random() for _ in range(n)], number=1)
+    print(f"make_random      {t:8.3f} s")
+    t = timeit(lambda: [PUID.from_int(i) for i in range(n)], number=1)
+    print(f"from_int         {t:8.3f} s")
+    ids = [PUID.from_int(i) for i in range(n)]
+    t = timeit(lambda: [a.as_int == i for i, a in enumerate(ids)], number=1)
+    print(f"as_int == int    {t:8.3f} s")
+    t = timeit(lambda: [a == b for a, b in zip(ids, ids[1:])], number=1)
+    print(f"== PUID          {t:8.3f} s")
+    t = timeit(lambda: set(ids), number=1)
+    print(f"hash (set)       {t:8.3f} s")
+
+
+def bench_paths(n: int = 10000):
+    """Resolve n data:// URLs, cold and warm."""
+    urls = [f"data://items/weapon/item-{i}.yaml" for i in range(n)]
+    invalidate_paths()
+    print(f"== resolve {n} URLs ==")
+    print(f"cold             {timeit(lambda: Protocol.resolve_many(urls), number=1):8.3f} s")
+    print(f"warm             {timeit(lambda: Protocol.resolve_many(urls), number=1):8.3f} s")
+
+
+def _sandbox() -> str:
+    """Point the App configuration path to a new temporary directory; return it."""
+    os.environ['HOME'] = mkdtemp()
+    root = os.path.expanduser("~/.config/RPGSample" if sys.platform.startswith('linux') else "~/.RPGSample")
+    os.makedirs(root)
+    invalidate_paths()
+    return root
+
+
+def bench_bundle(n: int = 2000):
+    """Cold-load n items from source files and from a compiled bundle."""
+    from libitems import ItemPath, ItemType
+    from libsavestate import AssetBundle, compile_data
+    root = _sandbox()
+    os.makedirs(root+'/data-source/items/bench')
+    for i in range(n):
+        ItemPath(f"items://bench/item-{i}.ini").save(
+            ItemType(f"item-{i}", 'bench', {'value': str(i)}))
+    print(f"== load {n} items ==")
+    t = timeit(lambda: [ItemPath(f"items://bench/item-{i}.ini").read()
+               for i in range(n)], number=1)
+    print(f"source files     {t:8.3f} s")
+    t = timeit(compile_data, number=1)
+    print(f"compile_data     {t:8.3f} s")
+    AssetBundle.forget()
+    t = timeit(lambda: [ItemPath(f"items://bench/item-{i}?compiled=true").read()
+               for i in range(n)], number=1)
+    print(f"bundle           {t:8.3f} s")
+
+
+def _profile(slots: int):
+    """A profile with a half-filled inventory of slots"""
+    from libchara import Character
+    from libgame import Profile
+    from libinventory import Inventory
+    from libitems import ItemType
+    inventory = Inventory('bench', slots)
+    potion = ItemType('potion', 'consumable', {'heal': 10}, 99)
+    inventory.add_many(ItemType(f"item-{i}", 'bench', {'value': i})
+                       for i in range(slots//4))
+    inventory.add(potion, 99*(slots//4))
+    return Profile(Character('Bench', 'None', 'None', 0), inventory)
+
+
+def bench_codec(slots: int = 10000, number: int = 5):
+    """Save codec against pickle on one profile."""
+    import pickle
+    from libsavestate import SaveCodec
+    profile = _profile(slots)
+    print(f"== profile with {slots} slots ==")
+    for name, dumps, unload in (("pickle", pickle.dumps, pickle.loads),
+                                ("SaveCodec", SaveCodec.dumps, SaveCodec.unload)):
+        data = dumps(profile)
+        encode = timeit(lambda: dumps(profile), number=number)/number
+        decode = timeit(lambda: unload(data), number=number)/number
+        print(f"{name:<10} {len(data):>9} bytes  encode {len(data)/encode/1e6:7.2f} MB/s {encode*1e3:8.2f} ms"
+              f"  decode {len(data)/decode/1e6:7.2f} MB/s {decode*1e3:8.2f} ms")
+
+
+def bench_levels(n: int = 100_000):
+    """Award EXP to n characters; batched against one level-up at a time."""
+    from random import Random
+    from liblvman import _numpy, default_manager
+    manager = default_manager()
+    rng = Random(0)
+    levels = [rng.randrange(0, 500) for _ in range(n)]
+    exp = [0]*n
+    gains = [rng.randrange(0, 10**12) for _ in range(n)]
+
+    def one_by_one():
+        for level, current, gain in zip(levels, exp, gains):
+            current += gain
+            while level < manager.max_level-1 and current >= manager.exp_for_level(level):
+                current -= manager.exp_for_level(level)
+                level += 1
+    print(f"== award EXP to {n} characters ==")
+    print(f"one by one       {timeit(one_by_one, number=1):8.3f} s")
+    print(f"award (array)    {timeit(lambda: manager.award(levels, exp, gains, False), number=1):8.3f} s")
+    if _numpy is not None:
+        print(f"award (NumPy)    {timeit(lambda: manager.award(levels, exp, gains, True), number=1):8.3f} s")
+
+
+def main(names):
+    benches = {name[6:]: func for name, func in globals().items()
+               if name.startswith('bench_')}
+    for name in (names or benches):
+        benches[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -5,7 +5,7 @@ from dataclasses import dataclass
 from posixpath import exists, realpath, splitext
 from typing import Any, Literal, Mapping, Union
 from libshared import DataPath, parse_data, load_data
-from libsavestate import DataUnpickler
+from libsavestate import SaveCodec, save_writer
 
 
 class CharaPath(DataPath, prefix="chara"):
@@ -26,14 +26,12 @@ class CharaPath(DataPath, prefix="chara"):
     def save(self, obj: Character):
         """save Character to destined path"""
         if self.IsCompiled is True:
-            with open(self.read_path(), 'wb') as f:
-                return f.write(DataUnpickler.dumps(obj))
+            return save_writer.write(self.read_path(), SaveCodec.dumps(obj))
 
     def load(self) -> Character:
         """load Character from path"""
         if self.IsCompiled is True:
-            with open(self.read_path(), 'rb') as f:
-                return DataUnpickler.unload(f.read())
+            return self.read_compiled()
 
 
 @dataclass(init=True)
@@ -44,10 +42,19 @@ class Character:
     race: str
     age: int
 
+    def __setattr__(self, name: str, value: Any):
+        """Implement self.name = value; marks this character as changed since the last save"""
+        object.__setattr__(self, name, value)
+        if name != '_dirty':
+            object.__setattr__(self, '_dirty', True)
+
     def __repr__(self):
         return f"{type(self).__name__}({self.name})"
 
 
+SaveCodec.register(10, Character, ('name', 'gender', 'race', 'age'))
+
+
 def _main():
     chara = Character("Debug", "None", 'None', 0)
     a = CharaPath("chara://_debug.chr?compiled=true")
@@ -19,37 +19,206 @@
 
 from __future__ import annotations
 
+from os.path import exists
+from struct import Struct
+from typing import Any, Dict, List, Sequence, Tuple
+from zlib import crc32
+
 from libchara import Character
 from libitems import ItemType
 from libmagic import MagicType
 from libinventory import Inventory
+from liblvman import LevelManager, LevelUps, default_manager
 from libshared import Project
-from libsavestate import DataUnpickler
+from libsavestate import SaveCodec, load_state, save_writer
+
+# Journal records; a little-endian length then a SaveCodec payload.
+# The first record names the snapshot it applies to, ('base', size, crc32).
+_journal_record = Struct('<I')
+
+
+def _pack_records(records: List[Tuple]) -> bytes:
+    """Return journal bytes of records"""
+    out = []
+    for record in records:
+        data = SaveCodec.dumps(record)
+        out.append(_journal_record.pack(len(data)))
+        out.append(data)
+    return b''.join(out)
+
+
+def _unpack_records(data: bytes) -> Tuple[List[Tuple], bool]:
+    """Return records of a journal and whether it's complete. A truncated (crashed) last record is dropped."""
+    records = []
+    offset = 0
+    while offset+_journal_record.size <= len(data):
+        size, = _journal_record.unpack_from(data, offset)
+        offset += _journal_record.size
+        if offset+size > len(data):
+            return records, False
+        records.append(SaveCodec.unload(data[offset:offset+size]))
+        offset += size
+    return records, offset == len(data)
+
+
+def _snapshot_base(data: bytes) -> Tuple[str, int, int]:
+    """Return the base record of a snapshot"""
+    return ('base', len(data), crc32(data))
+
 
 class ProfilePath(Project, prefix='profile'):
-    """Profile/save path"""
+    """Profile/save path. After a full snapshot, saves only append the changes to <path>.journal;
+    every compact_every saves the journal is folded back into a snapshot.
+    Saves are written in background, see libsavestate.save_writer."""
+    compact_every = 32
+    # Journal of every path saved or read; path -> (base record, records after it).
+    # Only a profile that wrote or read exactly that journal may append to it.
+    _journals: Dict[str, Tuple[Tuple, int]] = {}
+
     def read(self) -> Profile:
-        with open(self.read_path(), 'rb') as f:
-            return DataUnpickler.unload(f.read())
+        path = self.read_path()
+        save_writer.wait(path)
+        save_writer.wait(path+'.journal')
+        with open(path, 'rb') as f:
+            data = f.read()
+        profile = load_state(data)
+        records, complete = [], False
+        if exists(path+'.journal'):
+            with open(path+'.journal', 'rb') as f:
+                records, complete = _unpack_records(f.read())
+        base = _snapshot_base(data)
+        # A journal of another snapshot is stale; it's left from a crashed compaction.
+        if records[:1] == [base]:
+            for record in records[1:]:
+                profile._apply(record)
+        else:
+            records, complete = [None], False
+        # Nothing may be appended to a missing or damaged journal; the next save makes a snapshot.
+        if complete:
+            self._journals[path] = (base, len(records)-1)
+            profile._saved(path, base, len(records)-1)
+        else:
+            self._journals.pop(path, None)
+            profile._saved(None, None, 0)
+        return profile
+
+    def save(self, profile: Profile, full: bool = False):
+        """Save profile, return written bytes. full forces a snapshot."""
+        path = self.read_path()
+        records = None
+        # Another profile may have saved into path since; then this one's changes don't apply to it.
+        if not full and self._journals.get(path) == (profile._base, profile._journaled):
+            records = profile._changes(path)
+        if records is None or profile._journaled+len(records) > self.compact_every:
+            data = SaveCodec.dumps(profile)
+            base = _snapshot_base(data)
+            save_writer.write(path, data)
+            save_writer.write(path+'.journal', _pack_records([base]))
+            self._journals[path] = (base, 0)
+            profile._saved(path, base, 0)
+            return len(data)
+        if not records:
+            return 0
+        data = _pack_records(records)
+        save_writer.write(path+'.journal', data, append=True)
+        journaled = profile._journaled+len(records)
+        self._journals[path] = (profile._base, journaled)
+        profile._saved(path, profile._base, journaled)
+        return len(data)
+
+
+class _TrackedState(dict):
+    """Profile state; remembers whether it changed since the last save"""
+    __slots__ = ('dirty',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dirty = True
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.dirty = True
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.dirty = True
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.dirty = True
+
+    def setdefault(self, key, default=None):
+        self.dirty = True
+        return super().setdefault(key, default)
+
+    def pop(self, *args):
+        self.dirty = True
+        return super().pop(*args)
+
+    def popitem(self):
+        self.dirty = True
+        return super().popitem()
+
+    def clear(self):
+        super().clear()
+        self.dirty = True
 
-    def save(self, profile: Profile):
-        with open(self.read_path(), 'wb') as f:
-            return f.write(DataUnpickler.dumps(profile))
 
 class Profile:
     """Profile/Save object"""
     def __init__(self, character: Character, inventory: Inventory):
         self._chara = character
         self._inventory = inventory
-        self._state = dict(
+        self._state = _TrackedState(
             level=0,
             exp=0,
             wd=(0,0)
         )
+        # Where this profile was last saved/read, the base record of that snapshot
+        # and how many journal records follow it
+        self._saved_to: str = None
+        self._base: Tuple = None
+        self._journaled = 0
 
     def set_character(self, character: Character):
         self._chara = character
-    
+        self._chara._dirty = True
+
+    def _changes(self, path: str) -> List[Tuple]:
+        """Return journal records since the last save into path, None when a snapshot is needed"""
+        if self._saved_to != path:
+            return None
+        blocks = self._inventory._dirty_blocks()
+        if blocks is None:
+            return None
+        records = []
+        if self._state.dirty:
+            records.append(('state', dict(self._state)))
+        if getattr(self._chara, '_dirty', True):
+            records.append(('chara', self._chara))
+        records.extend(('block', index, block) for index, block in blocks)
+        return records
+
+    def _apply(self, record: Tuple[Any, ...]):
+        """Replay a journal record"""
+        kind = record[0]
+        if kind == 'state':
+            self._state.clear()
+            self._state.update(record[1])
+        elif kind == 'chara':
+            self._chara = record[1]
+        elif kind == 'block':
+            self._inventory._replace_block(record[1], record[2])
+
+    def _saved(self, path: str, base: Tuple, journaled: int):
+        """Mark everything as saved into path"""
+        self._saved_to = path
+        self._base = base
+        self._journaled = journaled
+        self._state.dirty = False
+        self._chara._dirty = False
+        self._inventory._clean()
+
     @property
     def inventory(self):
         """Inventory"""
@@ -58,6 +227,31 @@ class Profile:
     def __repr__(self):
         return f"{self._chara.name}[{self._state['level']}]"
 
+
+def award_exp(profiles: Sequence[Profile], gains: Sequence[int], manager: LevelManager = None) -> LevelUps:
+    """Give gains of EXP to profiles at once (see LevelManager.award); their level and exp are updated.
+    Return the LevelUps of them."""
+    manager = manager or default_manager()
+    result = manager.award([profile._state['level'] for profile in profiles],
+                           [profile._state['exp'] for profile in profiles], gains)
+    for profile, level, exp in zip(profiles, result.levels, result.exp):
+        state = profile._state
+        if state['level'] != level or state['exp'] != exp:
+            state['level'] = int(level)
+            state['exp'] = int(exp)
+    return result
+
+
+def _decode_profile(values) -> Profile:
+    chara, inventory, state = values
+    self = Profile(chara, inventory)
+    self._state.update(state)
+    return self
+
+
+SaveCodec.register(30, Profile, encode=lambda self: (self._chara, self._inventory, dict(self._state)),
+                   decode=_decode_profile)
+
 def _main():
     x = ProfilePath("profile://default.profile")
     y = Profile(Character('None', 'None', 'None', 0), Inventory('Main', 20))
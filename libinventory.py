@@ -10,12 +10,19 @@ Note: Inventory class is careful to its size; It'll scream at you when you are t
 
 from __future__ import annotations
 
-__all__ = ['SameIdentifierException',
-           'FixedSizeArray', 'LinkedFSA', 'Inventory', 'null', 'fsa_null']
-
-from typing import Any, List, Literal, Union
+__all__ = ['SameIdentifierException', 'FullyAllocatedException',
+           'FixedSizeArray', 'LinkedFSA', 'Stack', 'ItemRegistry', 'Inventory',
+           'item_registry', 'null', 'fsa_null']
+
+from array import array as _array
+from bisect import bisect_right
+from itertools import compress
+import sys
+from typing import (Any, Callable, Dict, Hashable, Iterable, Iterator, List,
+                    Literal, Mapping, Optional, Tuple, Union)
 import warnings
 from libshared import ConstCreator, PUID
+from libsavestate import SaveCodec
 
 null = ConstCreator.define('null', None)
 fsa_null = ConstCreator.define('<block not-found>', null)
@@ -25,17 +32,214 @@ class SameIdentifierException(Exception):
     """The given argument is the same object as saved/operated object."""
 
 
+class FullyAllocatedException(Exception):
+    """There's no free slot left to put the data in."""
+
+
+def _item_key(item: Any) -> Hashable:
+    """Return the key an item is indexed with.
+    That is item.key if defined (ItemType has one), or the item itself. Unhashable items are keyed by identity."""
+    key = getattr(item, 'key', item)
+    try:
+        hash(key)
+    except TypeError:
+        return id(item)
+    return key
+
+
+def _hashable_key(item: Any) -> bool:
+    """Return true if item is indexed by its key, not by identity (see _item_key)"""
+    try:
+        hash(getattr(item, 'key', item))
+    except TypeError:
+        return False
+    return True
+
+
+def _stack_limit(item: Any) -> int:
+    """Return how many of an item fit in one slot (ItemType.stack)"""
+    return getattr(item, 'stack', 1)
+
+
+class Stack:
+    """A slot holding count of the same item.
+    Inventory never changes a stack in a slot; it puts a new one, so snapshots keep their counts."""
+    __slots__ = ('item', 'count')
+
+    def __init__(self, item: Any, count: int = 1):
+        self.item = item
+        self.count = count
+
+    @property
+    def key(self):
+        """Item key of this stack; the same as its item."""
+        return _item_key(self.item)
+
+    @property
+    def limit(self):
+        """Max count of this stack"""
+        return _stack_limit(self.item)
+
+    @property
+    def full(self):
+        """Return true if nothing can be merged into this stack"""
+        return self.count >= self.limit
+
+    def __repr__(self):
+        return f"{self.item!r}x{self.count}"
+
+
+def _slot_key(data: Any) -> Any:
+    """Return the key of slot data (a Stack's is its item's) like _item_key(), skipping its hashability check.
+    Only for comparing with a hashable key."""
+    if type(data) is Stack:
+        data = data.item
+    return getattr(data, 'key', data)
+
+
+def _quantity(data: Any) -> int:
+    """Return how many items a slot data holds"""
+    return data.count if isinstance(data, Stack) else 1
+
+
+class ItemRegistry:
+    """Registry of items stored in typed FixedSizeArray. Maps item key <-> integer id; 0 is null.
+    Items with the same key share one registered object."""
+    __slots__ = ('_items', '_ids')
+
+    def __init__(self):
+        self._items: List[Any] = [null]
+        self._ids: Dict[Hashable, int] = {}
+
+    def id(self, item: Any) -> int:
+        """Return id of an item, registering it if needed."""
+        if item is null:
+            return 0
+        if isinstance(item, Stack):
+            raise TypeError("Stack can't be stored in typed array.")
+        key = _item_key(item)
+        i = self._ids.get(key)
+        if i is None:
+            i = self._ids[key] = len(self._items)
+            self._items.append(item)
+        return i
+
+    def find(self, item: Any) -> int:
+        """Return id of a registered item. Raise ValueError if it is not registered."""
+        if item is null:
+            return 0
+        try:
+            return self._ids[_item_key(item)]
+        except KeyError:
+            raise ValueError(f"{item!r} is not registered") from None
+
+    def item(self, i: int) -> Any:
+        """Return item of an id"""
+        return self._items[i]
+
+    def __len__(self):
+        return len(self._items)-1
+
+
+item_registry = ItemRegistry()
+
+
+# Turns FixedSizeArray free flags into occupied flags
+_occupied = bytes.maketrans(b'\x00\x01', b'\x01\x00')
+
+
+class _TypedStore:
+    """List-like backing store of typed FixedSizeArray; holds item ids in array('I')."""
+    __slots__ = ('_ids', '_registry')
+
+    def __init__(self, registry: ItemRegistry, ids: _array):
+        self._registry = registry
+        self._ids = ids
+
+    @classmethod
+    def blank(cls, registry: ItemRegistry, size: int) -> _TypedStore:
+        return cls(registry, _array('I', [0])*size)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return _TypedStore(self._registry, self._ids[index])
+        return self._registry._items[self._ids[index]]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            self._ids[index] = _array('I', map(self._registry.id, value))
+            return
+        self._ids[index] = self._registry.id(value)
+
+    def __iter__(self):
+        items = self._registry._items
+        return (items[i] for i in self._ids)
+
+    def _find(self, value) -> int:
+        """Return id of value. Raise ValueError unless its registered item equals it."""
+        i = self._registry.find(value)
+        if self._registry._items[i] != value:
+            raise ValueError(f"{value!r} is not registered")
+        return i
+
+    def __contains__(self, value):
+        try:
+            return self._find(value) in self._ids
+        except ValueError:
+            return False
+
+    def index(self, value) -> int:
+        return self._ids.index(self._find(value))
+
+    def count(self, value) -> int:
+        try:
+            return self._ids.count(self._find(value))
+        except ValueError:
+            return 0
+
+    def extend(self, values):
+        self._ids.extend(map(self._registry.id, values))
+
+    def clear(self):
+        del self._ids[:]
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def _sort_key(data: Any) -> Tuple[str, str]:
+    """Default Inventory.sort key; (type, name) of the item"""
+    item = data.item if isinstance(data, Stack) else data
+    return (str(getattr(item, 'type', '')), str(getattr(item, 'name', item)))
+
+
 class FixedSizeArray:
-    """Fixed-size array (not so)"""
+    """Fixed-size array (not so)
+
+    Pass registry (e.g. item_registry) to store item ids in array('I') instead of item references."""
+    __slots__ = ('_size', '__array', '__free', '__allocated', '__index', '__shared',
+                 '__dirty', '__registry', '__address', '__noalloc', '_name', '_owner')
 
     def __init_subclass__(cls, **kwargs) -> None:
         raise Exception("Cannot subclass FSA.")
 
-    def __init__(self, size: int, noallocate=False):
+    def __init__(self, size: int, noallocate=False, registry: ItemRegistry = None):
         self._size = size
-        self.__array: List[Union[ConstCreator, Any]] = [null]*size
-        self.__fake_address_UUID = PUID.make_random()
-        self.__fake_address = self.__fake_address_UUID.body.upper()
+        self.__registry = registry
+        self.__array: Union[List[Union[ConstCreator, Any]], _TypedStore] = self._blank(size)
+        # Occupancy; __free[i] is 1 when slot i holds null.
+        self.__free = bytearray(b'\x01')*size
+        self.__allocated = 0
+        # Reverse index; item key -> {slot: None}. None until enable_index()
+        self.__index: Dict[Hashable, Dict[int, None]] = None
+        # Set when __array/__free are shared with a snapshot; see _own()
+        self.__shared = False
+        # Set on every write, cleared once saved; see _clean()
+        self.__dirty = True
+        self.__address: str = None  # Made on first access
         self.__noalloc = noallocate
         self._name = None
         self._owner = None
@@ -43,22 +247,204 @@ class FixedSizeArray:
     def insert(self, index: int, data: Any):
         """Insert an object before index"""
         self._yell_at_externally_extended_size()
-        if index > self._size-1:
+        if index < 0:
+            index += self._size
+        if index > self._size-1 or index < 0:
             raise IndexError(
                 "Array index out of range; you can do self.allocate(<length>)")
-        self.__array.insert(index, data)
-        self.__array.pop(index+1)
+        self._own()
+        old = self.__array[index]
+        self.__array[index] = data
+        self._occupy(index, old, data)
 
     def pop(self, index: int):
         """Remove and return an item at index."""
         self._yell_at_externally_extended_size()
-        self.__array.insert(index, null)
-        return self.__array.pop(index+1)
+        if index < 0:
+            index += self._size
+        if index > self._size-1 or index < 0:
+            raise IndexError("Array index out of range")
+        self._own()
+        data = self.__array[index]
+        self.__array[index] = null
+        self._occupy(index, data, null)
+        return data
+
+    def _occupy(self, index: int, old: Any, new: Any):
+        """Update occupancy of a slot after old is replaced by new"""
+        if old is null:
+            if new is not null:
+                self.__free[index] = 0
+                self.__allocated += 1
+        elif new is null:
+            self.__free[index] = 1
+            self.__allocated -= 1
+        if self.__index is None:
+            return
+        if old is not null:
+            key = _item_key(old)
+            slots = self.__index[key]
+            del slots[index]
+            if not slots:
+                del self.__index[key]
+                if self._owner is not None:
+                    self._owner._index_update(self, key, -1)
+            elif self._owner is not None:
+                self._owner._index_update(self, key, 0, -1)
+        if new is not null:
+            key = _item_key(new)
+            slots = self.__index.get(key)
+            if slots is None:
+                self.__index[key] = {index: None}
+                if self._owner is not None:
+                    self._owner._index_update(self, key, 1)
+            else:
+                slots[index] = None
+                if self._owner is not None:
+                    self._owner._index_update(self, key, 0, 1)
+
+    # Bulk methods; slots must be already checked (0 <= slot < size)
+
+    def _set_many(self, pairs: Iterable[Tuple[int, Any]]):
+        """Set many slots at once"""
+        self._yell_at_externally_extended_size()
+        self._own()
+        array = self.__array
+        occupy = self._occupy
+        for slot, data in pairs:
+            old = array[slot]
+            array[slot] = data
+            occupy(slot, old, data)
+
+    def _get_many(self, slots: Iterable[int]) -> List[Any]:
+        """Get many slots at once"""
+        array = self.__array
+        return [array[slot] for slot in slots]
+
+    def _pop_many(self, slots: Iterable[int]) -> List[Any]:
+        """Get and remove many slots at once"""
+        self._yell_at_externally_extended_size()
+        self._own()
+        array = self.__array
+        occupy = self._occupy
+        x = []
+        for slot in slots:
+            data = array[slot]
+            array[slot] = null
+            occupy(slot, data, null)
+            x.append(data)
+        return x
+
+    def _live(self) -> List[Any]:
+        """Return all non-null data, in slot order"""
+        return [data for data in self.__array if data is not null]
+
+    def _occupied_slots(self) -> List[int]:
+        """Return slots holding non-null data, in order"""
+        free = self.__free
+        if self.__allocated*8 > self._size:
+            return list(compress(range(self._size), free.translate(_occupied)))
+        slots = []  # Few; find them one by one
+        slot = free.find(0)
+        while slot != -1:
+            slots.append(slot)
+            slot = free.find(0, slot+1)
+        return slots
+
+    def _load(self, items: List[Any]):
+        """Replace the whole array with items on leading slots. items must not hold null."""
+        self._yell_at_externally_extended_size()
+        n = len(items)
+        if n > self._size:
+            raise IndexError("Array out of range")
+        self._own()
+        self.__array[:n] = items
+        self.__array[n:] = [null]*(self._size-n)
+        self.__free[:n] = bytes(n)
+        self.__free[n:] = b'\x01'*(self._size-n)
+        self.__allocated = n
+        self._rebuild_index()
+
+    def enable_index(self):
+        """Keep a reverse index of item key to slots, updated on every write."""
+        if self.__index is not None:
+            return
+        index: Dict[Hashable, Dict[int, None]] = {}
+        for slot, data in enumerate(self.__array):
+            if data is not null:
+                index.setdefault(_item_key(data), {})[slot] = None
+        self.__index = index
+
+    def _rebuild_index(self):
+        """Rebuild the reverse index (if enabled) after a bulk change."""
+        if self.__index is None:
+            return
+        owner = self._owner
+        if owner is not None:
+            owner._unindex_block(self)
+        self.__index = None
+        self.enable_index()
+        if owner is not None:
+            owner._index_block(self)
+
+    @property
+    def indexed(self):
+        """Return true if this array keeps a reverse index"""
+        return self.__index is not None
+
+    def _index_counts(self):
+        """Yield (item key, item count) from the reverse index"""
+        for key, slots in self.__index.items():
+            yield key, len(slots)
+
+    def _candidates(self, value) -> Optional[Iterable[int]]:
+        """Return slots that may hold value, from the reverse index. None when all slots must be searched."""
+        if self.__index is None or not _hashable_key(value):
+            return None
+        return self.__index.get(_item_key(value), ())
+
+    def _key_slots(self, key: Hashable) -> List[int]:
+        """Return slots holding an item (or a Stack of it) keyed key, in order"""
+        if self.__index is not None:
+            return sorted(self.__index.get(key, ()))
+        slots = self._occupied_slots()
+        return [slot for slot, data in zip(slots, self._get_many(slots)) if _slot_key(data) == key]
+
+    # Items are matched with ==, indexed or not; the reverse index only narrows the search.
+
+    def find_all(self, value) -> List[int]:
+        """Return all slots holding value."""
+        array = self.__array
+        slots = self._candidates(value)
+        if slots is None:
+            return [i for i, data in enumerate(array) if data is not null and data == value]
+        return sorted(slot for slot in slots if array[slot] == value)
+
+    def count(self, value) -> int:
+        """Return how many slots hold value."""
+        slots = self._candidates(value)
+        if slots is None:
+            if value is null:
+                return 0
+            return self.__array.count(value)
+        array = self.__array
+        return sum(1 for slot in slots if array[slot] == value)
+
+    def find_free(self, start: int = 0) -> int:
+        """Return index of the first free slot from start. -1 if the array is fully allocated."""
+        return self.__free.find(1, start)
 
     def remove(self, value):
         """Remove an item based on value"""
         self._yell_at_externally_extended_size()
-        i = self.__array.index(value)
+        slots = self._candidates(value)
+        if slots is None:
+            i = self.__array.index(value)
+        else:
+            array = self.__array
+            i = min((slot for slot in slots if array[slot] == value), default=-1)
+            if i == -1:
+                raise ValueError(f"{value!r} is not in array")
         self.pop(i)
 
     def __len__(self):
@@ -67,20 +453,37 @@ class FixedSizeArray:
 
     def __iter__(self):
         """Implement iter(self)"""
-        yield self.__array.__iter__()
+        yield from self.__array
+
+    iter_items = __iter__
+
+    def iter_occupied(self) -> Iterator[Any]:
+        """Iterate over non-null items"""
+        for data in self.__array:
+            if data is not null:
+                yield data
+
+    def iter_slots(self) -> Iterator[Tuple[int, Any]]:
+        """Iterate over (index, item) of all slots"""
+        yield from enumerate(self.__array)
 
     def clear(self):
         """Clear all item from array."""
-        self.__array.clear()
-        self.__array.extend([null]*self._size)
+        self.__array = self._blank(self._size)
+        self.__free = bytearray(b'\x01')*self._size
+        self.__shared = False
+        self.__dirty = True
+        self.__allocated = 0
+        self._rebuild_index()
 
     def copy(self, noalloc: bool = True) -> 'FixedSizeArray':
         """Copy an item from an array"""
-        ret = FixedSizeArray(self._size, noalloc)
-        for i, x in enumerate(self):
-            if x is null:
-                continue
-            ret.insert(i, x)
+        ret = FixedSizeArray(0, noalloc, self.__registry)
+        ret._size = self._size
+        ret.__array = self.__array[:]
+        ret.__free = self.__free[:]
+        ret.__allocated = self.__allocated
+        return ret
 
     @classmethod
     def new(cls, *instances) -> 'FixedSizeArray':
@@ -88,9 +491,37 @@ class FixedSizeArray:
         if len(instances) == 1:
             if hasattr(instances[0], '__iter__'):
                 instances = instances[0]
-        self = cls(len(instances))
-        for i, x in enumerate(instances):
-            self.insert(i, x)
+        self = cls(0)
+        self.__array = list(instances)
+        self.__free = bytearray(data is null for data in self.__array)
+        self._size = len(self.__array)
+        self.__allocated = self._size - self.__free.count(1)
+        return self
+
+    def snapshot(self) -> 'FixedSizeArray':
+        """Return a copy of this array sharing storage with it until either of them is written to.
+        The items are shared, not copied."""
+        ret = FixedSizeArray(0, self.__noalloc, self.__registry)
+        ret._size = self._size
+        ret.__array = self.__array
+        ret.__free = self.__free
+        ret.__allocated = self.__allocated
+        ret.__shared = self.__shared = True
+        return ret
+
+    def _blank(self, size: int):
+        """Return a new backing store of size null slots"""
+        if self.__registry is None:
+            return [null]*size
+        return _TypedStore.blank(self.__registry, size)
+
+    def _own(self):
+        """Stop sharing storage with snapshots; called before any write."""
+        self.__dirty = True
+        if self.__shared:
+            self.__array = self.__array[:]
+            self.__free = self.__free[:]
+            self.__shared = False
 
     def __setitem__(self, index: int, value: int):
         """Implement self[index] = value"""
@@ -112,8 +543,11 @@ class FixedSizeArray:
         """Allocate new size for the array"""
         if self.__noalloc is True:
             raise Exception("This array can't be allocated.")
+        self._own()
         self.__array.extend([null]*size)
+        self.__free.extend(b'\x01'*size)
         self._size = len(self.__array)
+        self._resized()
 
     def free(self, size: int):
         """Release/take away size from the array."""
@@ -124,24 +558,36 @@ class FixedSizeArray:
         if size > len(self.__array):
             raise Exception(
                 "Failed to freeing larger amount of allocated data.")
+        self._own()
         if size == 0:
             self.__array.clear()
             self._size = 0
         else:
             self.__array = self.__array[:len(self.__array)-size]
             self._size = len(self.__array)
+        del self.__free[self._size:]
+        self.__allocated = self._size - self.__free.count(1)
+        self._rebuild_index()
+        self._resized()
 
     # end of rule breaker
 
     @property
     def address(self):
         """Return pseudo address of this array."""
-        return self.__fake_address
+        if self.__address is None:
+            self.__address = PUID.make_random().body.upper()
+        return self.__address
 
     @property
     def allocated(self):
         """Return how much allocated data in this array."""
-        return len([data for data in self.__array if data is not null])
+        return self.__allocated
+
+    @property
+    def available(self):
+        """Return how much free slot in this array."""
+        return self._size - self.__allocated
 
     @property
     def size(self):
@@ -150,6 +596,20 @@ class FixedSizeArray:
 
     # We can finally calculate used space or whatever
 
+    @property
+    def registry(self):
+        """Return the item registry of a typed array, None otherwise"""
+        return self.__registry
+
+    @property
+    def dirty(self):
+        """Return true if this array changed since it was last saved"""
+        return self.__dirty
+
+    def _clean(self):
+        """Mark this array as saved"""
+        self.__dirty = False
+
     @property
     def allow_alloc(self):
         """Return true if this array allocable"""
@@ -170,6 +630,11 @@ class FixedSizeArray:
         """Return repr(self)"""
         return repr(self.__array)
 
+    def _resized(self):
+        """Tell the owner (if any) that this array size is changed."""
+        if self._owner is not None:
+            self._owner._invalidate()
+
     def _set_name(self, owner: LinkedFSA, name: str):
         """Set link name of this array. Owner must be instance of LinksedFSA"""
         if not isinstance(owner, LinkedFSA):
@@ -197,22 +662,47 @@ class FixedSizeArray:
 
     def __contains__(self, other):
         """Return true if something is in this array."""
-        return other in self.__array if other is not null else False
+        if other is null:
+            return False
+        slots = self._candidates(other)
+        if slots is None:
+            return other in self.__array
+        array = self.__array
+        return any(array[slot] == other for slot in slots)
 
 
 class LinkedFSA:
     """Linked FixedSizeArray"""
+    __slots__ = ('_links', '_link_puid', '_index', '_offsets', '_blocks', '_starts', '_size',
+                 '_changed')
 
     def __init_subclass__(cls, **kwargs) -> None:
         raise Exception("LinkedFSA must not be subclassed.")
 
-    def __init__(self, *array: FixedSizeArray):
+    def __init__(self, *array: FixedSizeArray, indexed: bool = False):
         self._links: List[FixedSizeArray] = []
-        self._linkID = PUID.make_random()
+        self._link_puid: PUID = None  # Made on first access, see _linkID
+        # Reverse index; item key -> {block: slots holding it}. None if not indexed.
+        self._index: Dict[Hashable, Dict[FixedSizeArray, int]] = {} if indexed else None
+        # Offset index; global start of every non-empty block and its link index.
+        # Rebuilt lazily, see _offset_index()
+        self._offsets: List[int] = None
+        self._blocks: List[int] = None
+        self._starts: Dict[FixedSizeArray, int] = None
+        self._size = 0
+        # Set when links (or their sizes) changed since the last save
+        self._changed = True
         for x in array:
             self._watcher(x)
             self.append(x)
 
+    @property
+    def _linkID(self) -> PUID:
+        """UID of this instance"""
+        if self._link_puid is None:
+            self._link_puid = PUID.make_random()
+        return self._link_puid
+
     def _watcher(self, array: FixedSizeArray):
         """Watcher method of incoming array"""
         if not isinstance(array, FixedSizeArray):
@@ -223,6 +713,8 @@ class LinkedFSA:
         fsa = self._links.pop(block_index)
         self._links.insert(block_index, fsa_null)
         fsa._reset_name(self)
+        self._unindex_block(fsa)
+        self._invalidate()
 
     def __len__(self):
         """Implement len(self)"""
@@ -249,7 +741,16 @@ class LinkedFSA:
         for link in self._links:
             if link is fsa_null:
                 continue  # skip on NULL
-            x += link.size - link.allocated
+            x += link.available
+        return x
+
+    @property
+    def stack_available(self):
+        """Free slots able to hold a Stack; typed blocks can't."""
+        x = 0
+        for link in self._links:
+            if link is not fsa_null and link.registry is None:
+                x += link.available
         return x
 
     @property
@@ -260,7 +761,7 @@ class LinkedFSA:
             if link is fsa_null:
                 x.append(0)
                 continue
-            x.append(link.size - link.allocated)
+            x.append(link.available)
         return tuple(x)
 
     @property
@@ -277,12 +778,8 @@ class LinkedFSA:
     @property
     def size(self):
         """Size of all link"""
-        x = 0
-        for link in self._links:
-            if link is fsa_null:
-                continue  # skip on NULL
-            x += link.size
-        return x
+        self._offset_index()
+        return self._size
 
     @property
     def name(self):
@@ -301,13 +798,14 @@ class LinkedFSA:
         """Append a FixedSizeArray into this instance"""
         for x in value:
             self._watcher(x)
-            addresses = [link.address for link in self._links]
-            if x.address in addresses:
+            if x._owner is self:
                 raise ValueError(
                     "The value is somewhat exists in this LinkedFSA")
             lid = len(self._links)
             x._set_name(self, f'link-block({lid})')
             self._links.append(x)
+            self._index_block(x)
+            self._invalidate()
 
     def insert(self, index: int, value: FixedSizeArray):
         """Insert a new link into given index"""
@@ -317,6 +815,8 @@ class LinkedFSA:
         [link._set_name(
             self, f'link-block({self._links.index(link)+1})') for link in links]
         self._links.insert(index, value)
+        self._index_block(value)
+        self._invalidate()
 
     def pop(self, index: int) -> FixedSizeArray:
         """Get a FSA and removes it."""
@@ -339,50 +839,137 @@ class LinkedFSA:
         value._set_name(self, name)
         self._links.insert(index, value)
         self._links.pop(index+1)
+        self._index_block(value)
+        self._invalidate()
+
+    # Reverse index
+
+    @property
+    def indexed(self):
+        """Return true if this instance keeps a reverse index"""
+        return self._index is not None
+
+    def _index_block(self, block: FixedSizeArray):
+        """Index all items of a newly linked block"""
+        if self._index is None:
+            return
+        block.enable_index()
+        for key, count in block._index_counts():
+            self._index.setdefault(key, {})[block] = count
+
+    def _unindex_block(self, block: FixedSizeArray):
+        """Forget all items of an unlinked block"""
+        if self._index is None or not block.indexed:
+            return
+        for key, _ in block._index_counts():
+            blocks = self._index[key]
+            del blocks[block]
+            if not blocks:
+                del self._index[key]
+
+    def _index_update(self, block: FixedSizeArray, key: Hashable, presence: int, count: int = 0):
+        """Called by a linked block on write. presence is 1/-1 when key appears/disappears in block,
+        otherwise count is the change of slots holding key."""
+        if self._index is None:
+            return
+        if presence == 1:
+            self._index.setdefault(key, {})[block] = 1
+        elif presence == -1:
+            blocks = self._index[key]
+            del blocks[block]
+            if not blocks:
+                del self._index[key]
+        else:
+            self._index[key][block] += count
+
+    def _candidate_blocks(self, data: Any) -> List[FixedSizeArray]:
+        """Return linked blocks that may hold data, in link order; the reverse index (if any) skips the others."""
+        links = [link for link in self._links if link is not fsa_null]
+        if self._index is None or not _hashable_key(data):
+            return links
+        blocks = self._index.get(_item_key(data), ())
+        return [link for link in links if link in blocks]
+
+    def count(self, data: Any) -> int:
+        """Return how many slots hold data."""
+        return sum(link.count(data) for link in self._candidate_blocks(data))
+
+    def find_all(self, data: Any) -> List[int]:
+        """Return global indices of all slots holding data."""
+        self._offset_index()
+        x = []
+        for block in self._candidate_blocks(data):
+            if block.size == 0:
+                continue
+            start = self._starts[block]
+            x.extend(start+slot for slot in block.find_all(data))
+        x.sort()
+        return x
+
+    def _key_slots(self, data: Any) -> List[Tuple[FixedSizeArray, int]]:
+        """Return (block, slot) of all slots holding an item with the same key as data"""
+        key = _item_key(data)
+        if self._index is not None:
+            blocks = self._index.get(key, ())
+        else:
+            blocks = (link for link in self._links if link is not fsa_null)
+        return [(block, slot) for block in blocks for slot in block._key_slots(key)]
+
+    def _global_index(self, block: FixedSizeArray, slot: int) -> int:
+        """Return global index of a slot in a linked block"""
+        self._offset_index()
+        return self._starts[block]+slot
+
+    # end of reverse index
 
     def __contains__(self, other):
         """Return true if other in this instance."""
-        for link in self._links:
-            if link is fsa_null:
-                continue
-            if other in link:
-                return True
-        return False
+        return any(other in link for link in self._candidate_blocks(other))
 
     def __repr__(self):
         """Implement repr(self)"""
         return '['+', '.join((link.address if hasattr(link, 'address') else str(link)) for link in self._links)+']'
 
+    def _invalidate(self):
+        """Drop the offset index. Called whenever links (or their sizes) changed."""
+        self._changed = True
+        self._offsets = None
+        self._blocks = None
+        self._starts = None
+
+    def _offset_index(self) -> List[int]:
+        """Return global start offset of every non-empty block (prefix-sum of link sizes)"""
+        if self._offsets is not None:
+            return self._offsets
+        offsets = []
+        blocks = []
+        starts = {}
+        total = 0
+        for i, link in enumerate(self._links):
+            if link is fsa_null or link.size == 0:
+                continue  # NULL and empty blocks can't hold anything
+            offsets.append(total)
+            blocks.append(i)
+            starts[link] = total
+            total += link.size
+        self._offsets = offsets
+        self._blocks = blocks
+        self._starts = starts
+        self._size = total
+        return offsets
+
     def _smart_index(self, link_index: int):
         # Say, index is 80 while our links is 2 50-sized array. 80-50 = 30
-        # This may can't use negative index. but, let's see...
         # Return: Link index, link's index
-        if link_index > self.size:
-            raise IndexError(
-                f"Linked Index out of range ({link_index} > {self.size}; perhaps you forgot to append?)")
+        offsets = self._offset_index()
+        size = self._size
         if link_index < 0:
-            while link_index < 0:
-                link_index += self.size
-        clsa = self.linksize
-        tli = link_index
-        for i, a in enumerate(clsa):
-            if tli > a:
-                tli -= a
-                continue
-            if self[i] is fsa_null:
-                if len(self) == i:
-                    raise IndexError("Index out or range")
-                i += 1
-            if tli == len(self[i]):
-                if len(self) == i:
-                    raise IndexError("Index out or range")
-                if self[i+1] == fsa_null:
-                    if len(self) == i+1:
-                        raise IndexError("Index out or range")
-                    return i+2, 0
-                return i+1, 0
-            return i, tli
-        raise Exception("Smart index can't return!")
+            link_index += size
+        if link_index < 0 or link_index >= size:
+            raise IndexError(
+                f"Linked Index out of range ({link_index} >= {size}; perhaps you forgot to append?)")
+        i = bisect_right(offsets, link_index) - 1
+        return self._blocks[i], link_index - offsets[i]
 
     def smart_insert(self, link_index: int, value: Any):
         """Insert a value into a link from a given index (The index should be less than self.size)"""
@@ -399,11 +986,195 @@ class LinkedFSA:
         i, li = self._smart_index(link_index)
         return self[i].pop(li)
 
+    def _resolve_many(self, indices: Iterable[int]) -> Dict[FixedSizeArray, List[Tuple[int, int]]]:
+        """Resolve global indices at once. Return {block: [(slot, position in indices)]}.
+        All indices are checked before anything is returned."""
+        offsets = self._offset_index()
+        size = self._size
+        blocks = self._blocks
+        links = self._links
+        x: Dict[FixedSizeArray, List[Tuple[int, int]]] = {}
+        for pos, index in enumerate(indices):
+            if index < 0:
+                index += size
+            if index < 0 or index >= size:
+                raise IndexError(
+                    f"Linked Index out of range ({index} >= {size}; perhaps you forgot to append?)")
+            i = bisect_right(offsets, index) - 1
+            x.setdefault(links[blocks[i]], []).append((index-offsets[i], pos))
+        return x
+
+    def smart_get_many(self, indices: Iterable[int]) -> List[Any]:
+        """Get values in given indices, in order."""
+        indices = list(indices)
+        x = [null]*len(indices)
+        for block, slots in self._resolve_many(indices).items():
+            for (_, pos), data in zip(slots, block._get_many(slot for slot, _ in slots)):
+                x[pos] = data
+        return x
+
+    def smart_set_many(self, mapping: Mapping[int, Any]):
+        """Insert values into given indices. mapping is {index: value}.
+        Nothing is written when a Stack would go into a typed block."""
+        values = list(mapping.values())
+        resolved = self._resolve_many(mapping.keys())
+        for block, slots in resolved.items():
+            if block.registry is not None and any(isinstance(values[pos], Stack) for _, pos in slots):
+                raise TypeError("Stack can't be stored in typed array.")
+        for block, slots in resolved.items():
+            block._set_many((slot, values[pos]) for slot, pos in slots)
+
+    def smart_pop_many(self, indices: Iterable[int]) -> List[Any]:
+        """Get and remove values in given indices, in order."""
+        indices = list(indices)
+        x = [null]*len(indices)
+        for block, slots in self._resolve_many(indices).items():
+            for (_, pos), data in zip(slots, block._pop_many(slot for slot, _ in slots)):
+                x[pos] = data
+        return x
+
+    # Iteration; null blocks are skipped.
+
+    def iter_items(self) -> Iterator[Any]:
+        """Iterate over items of all slots of all links"""
+        for link in self._links:
+            if link is not fsa_null:
+                yield from link
+
+    def iter_occupied(self) -> Iterator[Any]:
+        """Iterate over non-null items of all links"""
+        for link in self._links:
+            if link is not fsa_null:
+                yield from link.iter_occupied()
+
+    def iter_slots(self) -> Iterator[Tuple[int, Any]]:
+        """Iterate over (global index, item) of all slots of all links"""
+        offsets = self._offset_index()
+        for start, block in zip(offsets, self._blocks):
+            yield from enumerate(self._links[block], start)
+
+    # end of iteration
+
+    def _live(self) -> List[Any]:
+        """Return all non-null data of all links, in order"""
+        x = []
+        for link in self._links:
+            if link is not fsa_null:
+                x.extend(link._live())
+        return x
+
+    def _pack(self, items: List[Any]) -> List[Tuple[FixedSizeArray, int]]:
+        """Replace all links content with items, filling blocks from the first one.
+        Typed blocks take only non-Stack items, so enough untyped slots are kept for the Stacks
+        and items may move out of order around typed blocks.
+        Return (block, count put in block) of all filled blocks. Nothing is written when items don't fit."""
+        self._offset_index()
+        links = [self._links[block] for block in self._blocks]
+        stacks = [pos for pos, data in enumerate(items) if isinstance(data, Stack)]
+        room = sum(link.size for link in links if link.registry is None)
+        if len(items) > self.size or len(stacks) > room:
+            raise FullyAllocatedException(
+                f"Need {len(items)} slot ({len(stacks)} untyped), only {self.size} in all links ({room} untyped).")
+        taken = bytearray(len(items))
+        first = 0  # First item not taken
+        plain = 0  # Next non-Stack item to look at (typed blocks)
+        stack = 0  # Next Stack to look at (in stacks)
+        left = len(stacks)  # Stacks not taken
+        loads = []
+        for link in links:
+            load = []
+            if link.registry is None:
+                for _ in range(link.size):
+                    while first < len(items) and taken[first]:
+                        first += 1
+                    if first == len(items):
+                        break
+                    if room > left or isinstance(items[first], Stack):
+                        pos = first
+                    else:  # The rest of untyped slots are for stacks
+                        while taken[stacks[stack]]:
+                            stack += 1
+                        pos = stacks[stack]
+                    taken[pos] = 1
+                    load.append(items[pos])
+                    left -= isinstance(items[pos], Stack)
+                    room -= 1
+                room -= link.size-len(load)
+            else:
+                while plain < len(items) and len(load) < link.size:
+                    if not taken[plain] and not isinstance(items[plain], Stack):
+                        taken[plain] = 1
+                        load.append(items[plain])
+                    plain += 1
+            loads.append((link, load))
+        if not all(taken):
+            raise FullyAllocatedException(
+                f"Need {len(items)} slot, they don't fit in links.")
+        x = []
+        for link, load in loads:
+            link._load(load)
+            if load:
+                x.append((link, len(load)))
+        return x
+
+    def smart_add(self, value: Any) -> int:
+        """Put a value into the first free slot of all links. Return the global index of that slot."""
+        return self.smart_add_many((value,))[0]
+
+    def smart_add_many(self, values) -> List[int]:
+        """Put values into the first free slots of all links, in order. Return their global indices.
+        Stacks skip typed blocks. Nothing is put when there's not enough free slot for all values."""
+        values = list(values)
+        if len(values) > self.available:
+            raise FullyAllocatedException(
+                f"Need {len(values)} free slot, only {self.available} available.")
+        stacks = [pos for pos, value in enumerate(values) if isinstance(value, Stack)]
+        if stacks and any(link is not fsa_null and link.registry is not None for link in self._links):
+            return self._add_many_typed(values, stacks)
+        placed: List[int] = []
+        offsets = self._offset_index()
+        for start, block in zip(offsets, self._blocks):
+            if len(placed) == len(values):
+                break
+            link = self._links[block]
+            slot = link.find_free()
+            while slot != -1 and len(placed) < len(values):
+                link[slot] = values[len(placed)]
+                placed.append(start+slot)
+                slot = link.find_free(slot+1)
+        return placed
+
+    def _add_many_typed(self, values: List[Any], stacks: List[int]) -> List[int]:
+        """smart_add_many() with typed blocks; Stacks take the first free untyped slots, then
+        other values take the first free slots left."""
+        if len(stacks) > self.stack_available:
+            raise FullyAllocatedException(
+                f"Need {len(stacks)} free untyped slot, only {self.stack_available} available.")
+        free = []  # (global index, link, slot, typed) of all free slots, in order
+        for start, block in zip(self._offset_index(), self._blocks):
+            link = self._links[block]
+            slot = link.find_free()
+            while slot != -1:
+                free.append((start+slot, link, slot, link.registry is not None))
+                slot = link.find_free(slot+1)
+        plan: List[Tuple[int, FixedSizeArray, int, bool]] = [None]*len(values)
+        used = bytearray(len(free))
+        it = (i for i, entry in enumerate(free) if not entry[3])
+        for pos in stacks:
+            i = next(it)
+            used[i] = 1
+            plan[pos] = free[i]
+        it = (i for i in range(len(free)) if not used[i])
+        for pos in range(len(values)):
+            if plan[pos] is None:
+                plan[pos] = free[next(it)]
+        for value, (_, link, slot, _) in zip(values, plan):
+            link[slot] = value
+        return [entry[0] for entry in plan]
+
     def smart_remove(self, data: Any):
         """Remove a value from a link. The first matching item on a link is removed. This, doesn't really remove all matching items."""
-        for link in self._links:
-            if link is fsa_null:
-                continue
+        for link in self._candidate_blocks(data):
             if data in link:
                 link.remove(data)
                 return
@@ -412,15 +1183,22 @@ class LinkedFSA:
         """Implement self==other"""
         if isinstance(other, LinkedFSA):
             return self._linkID == other._linkID
+        return NotImplemented
+
+    def __hash__(self):
+        """Implement hash(self)"""
+        return hash(self._linkID)
 
 
 class Inventory:
     """Inventory class"""
 
-    def __init__(self, iname: str, size: int, *args):
-        """Init function"""
+    def __init__(self, iname: str, size: int, *args, indexed: bool = False):
+        """Init function. indexed keeps a reverse index of items for fast in/remove/count/find_all."""
         self._name = iname
-        self._array_list = LinkedFSA(FixedSizeArray(size, True))
+        self._array_list = LinkedFSA(FixedSizeArray(size, True), indexed=indexed)
+        # Partially filled stacks; item key -> {(block, slot): stack}. Entries may be stale, see _partials()
+        self._partial: Dict[Hashable, Dict[Tuple[FixedSizeArray, int], Stack]] = {}
 
     def extend_inventory(self, array: FixedSizeArray):
         """Adding an Inventory array"""
@@ -430,7 +1208,7 @@ class Inventory:
 
         if array.allow_alloc is True:
             warnings.warn("array is allocate-able.")
-            array = array.new()
+            array = array.copy()
         self._array_list.append(array)
 
     def __setitem__(self, index: int, value: Any):
@@ -445,22 +1223,351 @@ class Inventory:
         """Insert an item from inventory"""
         self._array_list.smart_insert(index, data)
 
+    def _partials(self, key: Hashable) -> List[Tuple[Tuple[FixedSizeArray, int], Stack]]:
+        """Return partially filled stacks of key. Stacks moved, removed or filled elsewhere are dropped."""
+        entries = self._partial.get(key)
+        if not entries:
+            return []
+        valid = []
+        for (block, slot), stack in list(entries.items()):
+            if block._owner is self._array_list and block[slot] is stack and not stack.full:
+                valid.append(((block, slot), stack))
+                continue
+            del entries[(block, slot)]
+        return valid
+
+    def _track(self, block: FixedSizeArray, slot: int, stack: Stack):
+        """Remember a stack as partially filled (or forget it when it's not)"""
+        entries = self._partial.setdefault(stack.key, {})
+        if stack.full or stack.count == 0:
+            entries.pop((block, slot), None)
+        else:
+            entries[(block, slot)] = stack
+
+    def _slots_needed(self, data: Any, count: int) -> int:
+        """Return how many free slots are needed to add count of data"""
+        limit = _stack_limit(data)
+        if limit <= 1:
+            return count
+        room = sum(stack.limit-stack.count for _,
+                   stack in self._partials(_item_key(data)))
+        return max(0, -(-(count-room)//limit))
+
+    def add(self, data: Any, count: int = 1) -> int:
+        """Put count of an item into the inventory. Stackable items are merged into existing stacks first,
+        the rest go into the first free slots. Return the slot index of the last touched slot."""
+        if count < 1:
+            raise ValueError(f"count must be positive (got {count})")
+        limit = _stack_limit(data)
+        if limit <= 1:
+            if count == 1:
+                return self._array_list.smart_add(data)
+            return self._array_list.smart_add_many([data]*count)[-1]
+        needed = self._slots_needed(data, count)
+        if needed > self._array_list.stack_available:
+            raise FullyAllocatedException(
+                f"Need {needed} free slot, only {self._array_list.stack_available} available for stacks.")
+        index = -1
+        for (block, slot), stack in self._partials(_item_key(data)):
+            if count == 0:
+                break
+            n = min(count, stack.limit-stack.count)
+            stack = Stack(stack.item, stack.count+n)
+            block[slot] = stack
+            count -= n
+            self._track(block, slot, stack)
+            index = self._array_list._global_index(block, slot)
+        stacks = []
+        while count > 0:
+            stacks.append(Stack(data, min(count, limit)))
+            count -= stacks[-1].count
+        if stacks:
+            index = self._array_list.smart_add_many(stacks)[-1]
+            block, slot = self._array_list._smart_index(index)
+            self._track(self._array_list[block], slot, stacks[-1])
+        return index
+
+    def add_many(self, items) -> List[int]:
+        """Put items into the first free slots, in order. Stackable items are merged like add().
+        Return the slot index of every item. Raise FullyAllocatedException (and put nothing) when they can't all fit."""
+        items = list(items)
+        if not any(_stack_limit(item) > 1 for item in items):
+            return self._array_list.smart_add_many(items)
+        # Only stackable items are counted by key; others take a slot each, as themselves.
+        counts: Dict[Hashable, List] = {}
+        plain = 0
+        for item in items:
+            if _stack_limit(item) > 1:
+                counts.setdefault(_item_key(item), [item, 0])[1] += 1
+            else:
+                plain += 1
+        stacked = sum(self._slots_needed(item, count)
+                      for item, count in counts.values())
+        links = self._array_list
+        if plain+stacked > links.available or stacked > links.stack_available:
+            raise FullyAllocatedException(
+                f"Need {plain+stacked} free slot ({stacked} for stacks), only {links.available} "
+                f"available ({links.stack_available} for stacks).")
+        if stacked and links.stack_available < links.available:
+            # Typed blocks are linked; put stacks first so other items can't take their slots.
+            x = {pos: self.add(item) for pos, item in enumerate(items) if _stack_limit(item) > 1}
+            x.update(zip((pos for pos, item in enumerate(items) if _stack_limit(item) <= 1),
+                         links.smart_add_many(item for item in items if _stack_limit(item) <= 1)))
+            return [x[pos] for pos in range(len(items))]
+        return [self.add(item) for item in items]
+
     def pop(self, index: int):
         """Pop an item from inventory"""
-        self._array_list.smart_pop(index)
-
-    def remove(self, data: Any):
-        """Remove an item from inventory"""
-        self._array_list.smart_remove(data)
+        return self._array_list.smart_pop(index)
+
+    def _repack(self, items: List[Any]):
+        """Put items into leading slots and rebuild partial stack index"""
+        self._partial.clear()
+        for block, n in self._array_list._pack(items):
+            for slot, data in enumerate(block._get_many(range(n))):
+                if isinstance(data, Stack):
+                    self._track(block, slot, data)
+
+    def compact(self, release: bool = False):
+        """Pack all items into the leading slots, merging partially filled stacks of the same item.
+        If release is true, detach trailing blocks that end up empty (the first block is kept)."""
+        items = []
+        opened: Dict[Hashable, Stack] = {}
+        for data in self._array_list._live():
+            if isinstance(data, Stack) and not data.full:
+                stack = opened.get(data.key)
+                count = data.count
+                if stack is not None:
+                    n = min(count, stack.limit-stack.count)
+                    stack.count += n
+                    count -= n
+                    if stack.full:
+                        del opened[data.key]
+                    if count == 0:
+                        continue
+                # Stacks in slots may be shared with snapshots; only change our own copy
+                data = Stack(data.item, count)
+                if not data.full:
+                    opened[data.key] = data
+            items.append(data)
+        self._repack(items)
+        if release:
+            links = self._array_list
+            for i in range(len(links)-1, 0, -1):
+                if links[i] is fsa_null:
+                    continue
+                if links[i].allocated != 0:
+                    break
+                links.detach(i)
+
+    def sort(self, key: Callable[[Any], Any] = None, reverse: bool = False):
+        """Sort items (and pack them into the leading slots).
+        Default order is by item type then name; stacks are sorted by their item."""
+        if key is None:
+            key = _sort_key
+        self._repack(sorted(self._array_list._live(), key=key, reverse=reverse))
+
+    def snapshot(self) -> Inventory:
+        """Return a copy of this inventory sharing block storage with it until either of them is written to.
+        Indexed inventories rebuild their reverse index on the copy."""
+        ret = Inventory.__new__(Inventory)
+        ret._name = self._name
+        blocks = {link: link.snapshot() for link in self._array_list._links
+                  if link is not fsa_null}
+        ret._array_list = LinkedFSA(*blocks.values(), indexed=self._array_list.indexed)
+        ret._partial = {key: {(blocks[block], slot): stack for (block, slot), stack in entries.items() if block in blocks}
+                        for key, entries in self._partial.items()}
+        return ret
+
+    def iter_items(self) -> Iterator[Any]:
+        """Iterate over items of all slots (null on empty slot)"""
+        return self._array_list.iter_items()
+
+    __iter__ = iter_items
+
+    def iter_occupied(self) -> Iterator[Any]:
+        """Iterate over items, skipping empty slots"""
+        return self._array_list.iter_occupied()
+
+    def iter_slots(self) -> Iterator[Tuple[int, Any]]:
+        """Iterate over (slot index, item) of all slots"""
+        return self._array_list.iter_slots()
+
+    def bulk_get(self, indices: Iterable[int]) -> List[Any]:
+        """Get items in many slots at once."""
+        return self._array_list.smart_get_many(indices)
+
+    def bulk_set(self, mapping: Mapping[int, Any]):
+        """Insert items into many slots at once. mapping is {index: item}."""
+        self._array_list.smart_set_many(mapping)
+
+    def bulk_pop(self, indices: Iterable[int]) -> List[Any]:
+        """Pop items from many slots at once."""
+        return self._array_list.smart_pop_many(indices)
+
+    def transfer(self, other: Inventory, indices: Iterable[int]) -> List[int]:
+        """Move items in given slots into the first free slots of other. Return their indices in other.
+        A slot given more than once is moved once; empty slots are skipped.
+        Raise FullyAllocatedException (and move nothing) when they can't all fit."""
+        if other is self:
+            raise SameIdentifierException("Can't transfer to the same inventory.")
+        size = self._array_list.size
+        # Repeated (or negative and positive) indices of the same slot move it once
+        indices = list(dict.fromkeys(index+size if index < 0 else index for index in indices))
+        moving = []
+        stacks = 0
+        for index, data in zip(indices, self.bulk_get(indices)):
+            if data is not null:
+                moving.append(index)
+                stacks += isinstance(data, Stack)
+        links = other._array_list
+        if len(moving) > links.available or stacks > links.stack_available:
+            raise FullyAllocatedException(
+                f"Need {len(moving)} free slot ({stacks} for stacks), only {links.available} "
+                f"available ({links.stack_available} for stacks).")
+        values = self.bulk_pop(moving)
+        placed = other._array_list.smart_add_many(values)
+        for index, data in zip(placed, values):
+            if isinstance(data, Stack):
+                block, slot = other._array_list._smart_index(index)
+                other._track(other._array_list[block], slot, data)
+        return placed
+
+    def remove(self, data: Any, count: int = 1):
+        """Remove count of an item from inventory. Stacks are split, the smallest first."""
+        if _stack_limit(data) <= 1 and count == 1:
+            self._array_list.smart_remove(data)
+            return
+        slots = self._array_list._key_slots(data)
+        quantity = [_quantity(block[slot]) for block, slot in slots]
+        if sum(quantity) < count:
+            raise ValueError(
+                f"Only {sum(quantity)} of {data!r} in inventory, can't remove {count}")
+        for _, (block, slot) in sorted(zip(quantity, slots), key=lambda x: x[0]):
+            if count == 0:
+                break
+            stack = block[slot]
+            if not isinstance(stack, Stack) or stack.count <= count:
+                count -= _quantity(stack)
+                block.pop(slot)
+                continue
+            stack = Stack(stack.item, stack.count-count)
+            block[slot] = stack
+            count = 0
+            self._track(block, slot, stack)
+
+    def count(self, data: Any) -> int:
+        """Return how many of an item is in inventory (stacks are counted by their size)"""
+        if _stack_limit(data) <= 1:
+            return self._array_list.count(data)
+        return sum(_quantity(block[slot]) for block, slot in self._array_list._key_slots(data))
+
+    def find_all(self, data: Any) -> List[int]:
+        """Return the slot indices holding an item"""
+        if _stack_limit(data) <= 1:
+            return self._array_list.find_all(data)
+        return sorted(self._array_list._global_index(block, slot)
+                      for block, slot in self._array_list._key_slots(data))
+
+    def __contains__(self, data: Any):
+        """Implement data in self."""
+        if _stack_limit(data) <= 1:
+            return data in self._array_list
+        return len(self._array_list._key_slots(data)) != 0
 
     def detach_inventory(self, array_id):
         """Release a inventory"""
         self._array_list.detach(array_id)
 
+    # Incremental saves
+
+    def _dirty_blocks(self) -> Optional[List[Tuple[int, Any]]]:
+        """Return (link index, encoded block) of blocks changed since the last save.
+        None when the links themselves changed and a full save is needed."""
+        if self._array_list._changed:
+            return None
+        return [(index, _encode_block(link)) for index, link in enumerate(self._array_list._links)
+                if link is not fsa_null and link.dirty]
+
+    def _replace_block(self, index: int, block: Any):
+        """Replace the block at link index with an encoded block"""
+        fsa = _decode_block(block)
+        self._array_list.replace(index, fsa)
+        self._track_block(fsa)
+
+    def _track_block(self, block: FixedSizeArray):
+        """Remember partially filled stacks of a (new) block"""
+        slots = block._occupied_slots()
+        for slot, data in zip(slots, block._get_many(slots)):
+            if type(data) is Stack and not data.full:
+                self._track(block, slot, data)
+
+    def _clean(self):
+        """Mark all blocks as saved"""
+        self._array_list._changed = False
+        for link in self._array_list._links:
+            if link is not fsa_null:
+                link._clean()
+
     def __repr__(self):
         return f"Inventory({self._name})"
 
 
+# A block is encoded as (size, allow_alloc, typed, slots, items); slots are the occupied slot
+# numbers packed as little-endian uint32 and items their data.
+
+
+def _encode_block(link: FixedSizeArray):
+    slots = _array('I', link._occupied_slots())
+    items = link._get_many(slots)
+    if sys.byteorder == 'big':
+        slots.byteswap()
+    return (link.size, link.allow_alloc, link.registry is not None, slots.tobytes(), items)
+
+
+def _decode_block(block) -> FixedSizeArray:
+    # Typed blocks are restored with the shared item_registry.
+    size, allow_alloc, typed, packed, items = block
+    slots = _array('I')
+    slots.frombytes(packed)
+    if sys.byteorder == 'big':
+        slots.byteswap()
+    if len(slots) != len(items):
+        raise ValueError("Block slots and items don't match")
+    fsa = FixedSizeArray(size, not allow_alloc,
+                         item_registry if typed else None)
+    fsa._set_many(zip(slots, items))
+    return fsa
+
+
+def _encode_inventory(self: Inventory):
+    blocks = [None if link is fsa_null else _encode_block(link)
+              for link in self._array_list._links]
+    return (self._name, self._array_list.indexed, blocks)
+
+
+def _decode_inventory(values) -> Inventory:
+    name, indexed, blocks = values
+    self = Inventory.__new__(Inventory)
+    self._name = name
+    self._partial = {}
+    self._array_list = links = LinkedFSA(indexed=indexed)
+    for block in blocks:
+        if block is None:
+            links.append(FixedSizeArray(0, True))
+            links.detach(len(links)-1)
+            continue
+        fsa = _decode_block(block)
+        links.append(fsa)
+        self._track_block(fsa)
+    return self
+
+
+SaveCodec.register(20, Stack, ('item', 'count'))
+SaveCodec.register(21, Inventory, encode=_encode_inventory,
+                   decode=_decode_inventory)
+
+
 def _main():
     fsa0 = FixedSizeArray(10, True)
     fsa1 = FixedSizeArray(10)
@@ -471,3 +1578,5 @@ def _main():
     inventory.extend_inventory(FixedSizeArray(50, True))
     inventory[51] = None
     assert inventory[51] is None
+    assert inventory.add('Potion') == 0
+    assert inventory.add_many(['Sword', 'Shield']) == [1, 2]
@@ -6,7 +6,7 @@ from configparser import ConfigParser
 from dataclasses import dataclass
 from posixpath import exists, realpath, splitext
 from typing import Any, Literal, Mapping, Union
-from libsavestate import DataUnpickler
+from libsavestate import SaveCodec, save_writer
 from libpostreq import yaml_installed
 from libshared import DataPath, load, parse
 
@@ -15,12 +15,11 @@ class ItemPath(DataPath, prefix='items'):
     """Item Protocol Handler"""
     def read(self):
         if self._config.get("compiled", False) is True:
-            with open(self.read_path(), 'rb') as f:
-                return DataUnpickler.unload(f.read())
+            return self.read_compiled()
         x = splitext(self.read_path())
         if x[1] == '.yaml':
             a = load(self.read_path())
-            return ItemType(a['name'], a['type'], a['speciality'])
+            return ItemType(a['name'], a['type'], a['speciality'], a.get('stack', 1))
         if x[1] == '.ini':
             a = load(self.read_path())
             fs = 0
@@ -38,32 +37,32 @@ class ItemPath(DataPath, prefix='items'):
                 raise Exception("The expected arguments are minimal")
             name = a['DEFAULTS']['name']
             type = a['DEFAULTS']['type']
-            speciality = a['DEFAULTS']['speciality'] if fs == 0 else a['speciality']
-            return ItemType(name, type, speciality)
+            speciality = a['speciality'] if fs == 0 else a['DEFAULTS']['speciality']
+            stack = int(a['DEFAULTS'].get('stack', 1))
+            return ItemType(name, type, speciality, stack)
         raise Exception("Unrecognized extention: %s" % x[1][1:])
 
     def save(self, item: ItemType):
         if self._config.get("compiled", False) is True:
-            with open(self.read_path(), 'wb') as f:
-                return f.write(DataUnpickler.dumps(item))
+            return save_writer.write(self.read_path(), SaveCodec.dumps(item))
         x = splitext(self.read_path())
         if x[1] == '.yaml':
             a = {
                 "name": item.name,
                 "type": item.type,
-                "speciality": item.speciality
+                "speciality": item.speciality,
+                "stack": item.stack
             }
-            with open(self.read_path(), 'w') as f:
-                return f.write(parse(a, 'yaml'))
+            return save_writer.write(self.read_path(), parse(a, 'yaml'))
         if x[1] == '.ini':
             a = ConfigParser({
                 "name": item.name,
                 "type": item.type,
+                "stack": str(item.stack),
             })
             a.add_section("speciality")
             a['speciality'].update(item.speciality)
-            with open(self.read_path(), 'w') as f:
-                return f.write(parse(a, 'ini'))
+            return save_writer.write(self.read_path(), parse(a, 'ini'))
         raise Exception("Unrecognized extention: %s" % x[1][1:])
 
 
@@ -72,6 +71,13 @@ class ItemType:
     name: str
     type: str
     speciality: Mapping[str, Union[str, int, bool]]
+    # How many of this item fit in one inventory slot
+    stack: int = 1
+
+    @property
+    def key(self):
+        """Identity of this item type; used by Inventory to index and stack items."""
+        return (self.type, self.name)
 
     def save(self):
         a = ItemPath(
@@ -85,5 +91,8 @@ class ItemType:
         return a.read()
 
 
+SaveCodec.register(11, ItemType, ('name', 'type', 'speciality', 'stack'))
+
+
 def _main():
     pass
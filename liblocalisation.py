@@ -5,62 +5,90 @@ This is an abstraction of locale or i18n.
 We don't use them as we're defining ourself."""
 
 from __future__ import annotations
-from typing import Dict, Union
+from collections import OrderedDict
+from functools import lru_cache
+from string import Formatter
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Tuple, Union
 
-from os.path import exists as p_exists
+from os import stat
+from os.path import exists as p_exists, splitext
 from libshared import DataPath, ConstCreator
-from shlex import split
+from libsavestate import AssetBundle, BundleError
 
-_locales: Dict[str, Dict[Union[str, int], str]] = {}  # Caching readed-localisation. We don't want to read everything again.
+# Opened locales; their compiled bundle, or the parsed locale when it couldn't be compiled.
+_locales: Dict[str, Union[AssetBundle, Dict[str, Dict[Union[str, int], str]]]] = {}
+# Loaded namespaces of every locale; (locale, namespace) -> texts, least recently used first.
+_namespaces: 'OrderedDict[Tuple[str, str], Dict[Union[str, int], str]]' = OrderedDict()
+# How many namespaces are kept loaded, across all locales
+namespace_limit = 64
+# Bumped by unload_locale(), so TextNamespace drops what it holds
+_generation = 0
 _current_locale = 'en'
 undefined = ConstCreator('Undefined', [5])
+# Name of the source mtime in a compiled locale; namespaces can't hold spaces.
+_source_mtime = 'source mtime'
 
-def _locale_reader(name, data: str) -> dict:
-    """ Read locale, returns dict because of #"""
-    r = data.split('\n')
+def _locale_reader(name, lines: Iterable[str]) -> dict:
+    """ Read locale, returns dict because of #. lines are read one by one (a file works)."""
     obj = {}
-    for i, a in enumerate(r):
-        if len(a) == 0:
+    for i, a in enumerate(lines):
+        if a[:1] != '@':
             continue
-        if a[0] != '@':
-            continue
-        b = a.split(' ')
+        b = a.rstrip('\r\n').split(' ', 2)
         if len(b) <= 2:
             raise Exception(
-                f"The required is 3 words. Got {len(b)} at line {i+1}")
-        namespace = b[0][1:]
-        nm = b[0]
-        if nm[0] != '@':
-            continue
-        if namespace not in obj:
-            obj[namespace] = {}
-        idname = b[1][1:]
-        idn = b[1]
-        values = ''.join(b[2:])  # Used in # and $ if # only 1 word.
-        if idn[0] not in ("#", '$'):
-            continue
-        if idn[0] == '#':
-            obj[namespace][idname] = values
-        if idn[0] == '$':
+                f"The required is 3 words. Got {len(b)} at line {i+1} of {name}")
+        nm, idn, values = b
+        namespace = nm[1:]
+        idname = idn[1:]
+        if idn[:1] == '#':
+            pass
+        elif idn[:1] == '$':
             if not idname.isnumeric():
                 raise Exception(
                     f"Not an integer while using $ (line {i+1} char {a.find('$')})")
             idname = int(idname)
-            obj[namespace][idname] = values
-    _locales[name] = obj
+        else:
+            continue
+        if namespace not in obj:
+            obj[namespace] = {}
+        obj[namespace][idname] = values
     return obj
 
 
+def _pack_namespace(texts: Dict[Union[str, int], str]) -> tuple:
+    """Return the string tables of a namespace; (count, #ids, texts, count, $ids, texts).
+    Parts are joined by newlines, which a locale line can't hold."""
+    names = [k for k in texts if isinstance(k, str)]
+    numbers = [k for k in texts if isinstance(k, int)]
+    return (len(names), '\n'.join(names), '\n'.join(texts[k] for k in names),
+            len(numbers), '\n'.join(map(str, numbers)), '\n'.join(texts[k] for k in numbers))
+
+
+def _unpack_namespace(tables: tuple) -> Dict[Union[str, int], str]:
+    """Inverse of _pack_namespace"""
+    count, names, values, ncount, numbers, nvalues = tables
+    texts = dict(zip(names.split('\n'), values.split('\n'))) if count else {}
+    if ncount:
+        texts.update(zip(map(int, numbers.split('\n')), nvalues.split('\n')))
+    return texts
+
+
 class LocalisationError(Exception):
     """A localisation file is not found"""
     pass
 
 
 class LCPath(DataPath, prefix='locale', compilable=False, default=1):
-    """Localisation Protocol Handlers."""
+    """Localisation Protocol Handlers.
+    A parsed locale is compiled into <name>.localec (an AssetBundle of namespaces); it's used
+    instead of the source as long as the source is not modified."""
     def read_path(self):
         return super().read_path()+'.locale'
 
+    def compiled_path(self):
+        return splitext(self.read_path())[0]+'.localec'
+
     def touch(self):
         with open(self.read_path(), 'w') as f:
             f.write("""To write a localisation, first. We need to know the syntax. It's quite simple.
@@ -83,21 +111,159 @@ Then, let's give it a shot!
 `@main #OK Oke
 `@main #Cancel Batal""")
 
-    def read(self) -> Localisation:
+    def read(self) -> Dict[str, Dict[Union[str, int], str]]:
+        """Return every namespace of this locale"""
+        source = self.open()
+        if isinstance(source, AssetBundle):
+            return {namespace: _unpack_namespace(source.get(namespace))
+                    for namespace in source.names() if namespace != _source_mtime}
+        return source
+
+    def open(self) -> Union[AssetBundle, Dict[str, Dict[Union[str, int], str]]]:
+        """Return the compiled locale, namespaces are loaded from it one by one.
+        The parsed locale is returned if it can't be compiled."""
+        mtime = stat(self.read_path()).st_mtime_ns
+        bundle = self._compiled(mtime)
+        if bundle is not None:
+            return bundle
         with open(self.read_path()) as f:
-            data = f.read()
-        return _locale_reader(self._path, data)
+            obj = _locale_reader(self._path, f)
+        self.compile(obj, mtime)
+        return self._compiled(mtime) or obj
+
+    def _compiled(self, mtime: int) -> Union[AssetBundle, None]:
+        """Return the compiled locale, None if it's missing or older than the source"""
+        path = self.compiled_path()
+        try:
+            # Decoded namespaces are kept by the caller, not by the bundle
+            bundle = AssetBundle.open(path, cache_size=0)
+        except (OSError, BundleError):
+            return None
+        if _source_mtime not in bundle or bundle.get(_source_mtime) != mtime:
+            return None
+        return bundle
+
+    def compile(self, obj: Dict[str, Dict[Union[str, int], str]], mtime: int):
+        """Write the compiled locale of obj; the source was modified at mtime (ns)"""
+        assets = {namespace: _pack_namespace(texts) for namespace, texts in obj.items()}
+        assets[_source_mtime] = mtime
+        try:
+            AssetBundle.write(self.compiled_path(), assets)
+        except OSError:  # Read-only data; parse the source next time too.
+            pass
 
     def exists(self) -> bool:
         return p_exists(self.read_path())
 
 
+def _open_locale(name: str) -> Union[AssetBundle, Dict[str, Dict[Union[str, int], str]], None]:
+    """Return an opened locale, None if it does not exists"""
+    source = _locales.get(name)
+    if source is None:
+        path = LCPath(f"locale://{name}")
+        if not path.exists():
+            return None
+        source = _locales[name] = path.open()
+    return source
+
+
+def _namespace(name: str, namespace: str) -> Union[Dict[Union[str, int], str], None]:
+    """Return texts of a namespace in a locale, loading it on first use. None if the locale does not exists."""
+    key = (name, namespace)
+    texts = _namespaces.get(key)
+    if texts is not None:
+        _namespaces.move_to_end(key)
+        return texts
+    source = _open_locale(name)
+    if source is None:
+        return None
+    if isinstance(source, AssetBundle):
+        texts = _unpack_namespace(source.get(namespace)) if namespace in source and namespace != _source_mtime else {}
+    else:
+        texts = source.get(namespace, {})
+    _namespaces[key] = texts
+    while len(_namespaces) > namespace_limit:
+        _namespaces.popitem(last=False)
+    return texts
+
+
+@lru_cache(maxsize=1024)
+def _template(text: str) -> Callable[[Mapping[str, Any]], str]:
+    """Return a compiled format of text; call it with a mapping of values.
+    Plain {name} fields are turned into a %-format, anything else is left to str.format_map."""
+    parts = []
+    for literal, field, spec, conversion in Formatter().parse(text):
+        parts.append(literal.replace('%', '%%'))
+        if field is None:
+            continue
+        if spec or conversion or not field.isidentifier():
+            return text.format_map
+        parts.append(f'%({field})s')
+    return ''.join(parts).__mod__
+
+
+class TextNamespace:
+    """Texts of a namespace in the current locale. Made by bind_namespace();
+    the namespace is looked up again only when the locale changed."""
+    __slots__ = ('_name', '_fallback', '_locale', '_generation', '_texts', '_formats')
+
+    def __init__(self, namespace: str, fallback: str = None):
+        self._name = namespace
+        self._fallback = fallback
+        self._locale = None
+        self._generation = None
+        self._texts: Dict[Union[str, int], str] = None
+        # Compiled formats of texts; referer -> _template()
+        self._formats: Dict[Union[str, int], Callable[[Mapping[str, Any]], str]] = {}
+
+    def _resolve(self) -> Dict[Union[str, int], str]:
+        if self._locale is not _current_locale or self._generation != _generation:
+            texts = _namespace(_current_locale, self._name)
+            if texts is None:
+                if self._fallback is None:
+                    raise LocalisationError(
+                        f"Locale {_current_locale} does not exists in locale path.")
+                texts = _namespace(self._fallback, self._name) or {}
+            self._texts = texts
+            self._formats = {}
+            self._locale = _current_locale
+            self._generation = _generation
+        return self._texts
+
+    def __getitem__(self, referer: Union[str, int]) -> Union[str, ConstCreator]:
+        """Implement self[referer]"""
+        return self._resolve().get(referer, undefined)
+
+    get_text = __getitem__
+
+    def get_texts(self, referers: Iterable[Union[str, int]]) -> List[Union[str, ConstCreator]]:
+        """Return texts of referers"""
+        texts = self._resolve()
+        return [texts.get(referer, undefined) for referer in referers]
+
+    def format_text(self, referer: Union[str, int], **values) -> Union[str, ConstCreator]:
+        """Return a text with its {fields} filled from values"""
+        texts = self._resolve()
+        render = self._formats.get(referer)
+        if render is None:
+            text = texts.get(referer, undefined)
+            if text is undefined:
+                return text
+            render = self._formats[referer] = _template(text)
+        return render(values)
+
+    def __repr__(self):
+        return f"TextNamespace({self._name})"
+
+
 class Localisation:
-    """Localisation object"""
+    """Localisation object. Namespaces are loaded on first get_text(), and only the last
+    namespace_limit of them (of all locales) are kept."""
 
-    def __init__(self, name: str, obj: Dict[str, Dict[Union[str, int], str]]):
+    def __init__(self, name: str, obj: Dict[str, Dict[Union[str, int], str]] = None):
         self._current_locale_name = name
-        self._current_locale = obj
+        if obj is not None:
+            _locales[name] = obj
 
     @staticmethod
     def set_locale(name: str):
@@ -107,8 +273,30 @@ class Localisation:
                 f"Locale {name} does not exists in locale path.")
         _current_locale = name
 
+    def _texts(self, namespace: str) -> Dict[Union[str, int], str]:
+        texts = _namespace(_current_locale, namespace)
+        if texts is None:
+            texts = _namespace(self._current_locale_name, namespace) or {}
+        return texts
+
     def get_text(self, namespace: str, referer: Union[str, int]) -> Union[str, ConstCreator]:
-        return _locales.get(_current_locale, self._current_locale).get(namespace, {}).get(referer, undefined)
+        return self._texts(namespace).get(referer, undefined)
+
+    def get_texts(self, namespace: str, referers: Iterable[Union[str, int]]) -> List[Union[str, ConstCreator]]:
+        """Return texts of referers in a namespace"""
+        texts = self._texts(namespace)
+        return [texts.get(referer, undefined) for referer in referers]
+
+    def format_text(self, namespace: str, referer: Union[str, int], **values) -> Union[str, ConstCreator]:
+        """Return a text with its {fields} filled from values"""
+        text = self._texts(namespace).get(referer, undefined)
+        if text is undefined:
+            return text
+        return _template(text)(values)
+
+    def bind_namespace(self, namespace: str) -> TextNamespace:
+        """Return texts of a namespace, for repeated lookups"""
+        return TextNamespace(namespace, self._current_locale_name)
 
     # Do not define set_text()
 
@@ -119,15 +307,51 @@ class Localisation:
 
     @staticmethod
     def load_locale(name: str) -> Localisation:
-        LCPath(f"locale://{name}").read()
-        return Localisation(name, _locales[name])
+        if _open_locale(name) is None:
+            raise LocalisationError(
+                f"Locale {name} does not exists in locale path.")
+        return Localisation(name)
+
+    @staticmethod
+    def unload_locale(name: str):
+        """Drop every loaded namespace of a locale and close it"""
+        global _generation
+        _generation += 1
+        source = _locales.pop(name, None)
+        for key in [key for key in _namespaces if key[0] == name]:
+            del _namespaces[key]
+        if isinstance(source, AssetBundle):
+            AssetBundle.forget(LCPath(f"locale://{name}").compiled_path())
 
     @staticmethod
     def is_this_exists(name: str):
         return LCPath(f"locale://{name}").exists()
 
+def _current_texts(namespace: str) -> Dict[Union[str, int], str]:
+    texts = _namespace(_current_locale, namespace)
+    if texts is None:
+        raise LocalisationError(
+            f"Locale {_current_locale} does not exists in locale path.")
+    return texts
+
 def get_text(namespace: str, referer: Union[str, int]) -> Union[str, ConstCreator]:
-    return _locales[_current_locale].get(namespace, {}).get(referer, undefined)
+    return _current_texts(namespace).get(referer, undefined)
+
+def get_texts(namespace: str, referers: Iterable[Union[str, int]]) -> List[Union[str, ConstCreator]]:
+    """Return texts of referers in a namespace"""
+    texts = _current_texts(namespace)
+    return [texts.get(referer, undefined) for referer in referers]
+
+def format_text(namespace: str, referer: Union[str, int], **values) -> Union[str, ConstCreator]:
+    """Return a text with its {fields} filled from values"""
+    text = _current_texts(namespace).get(referer, undefined)
+    if text is undefined:
+        return text
+    return _template(text)(values)
+
+def bind_namespace(namespace: str) -> TextNamespace:
+    """Return texts of a namespace, for repeated lookups"""
+    return TextNamespace(namespace)
 
 def _main():
     pass
@@ -1,21 +1,171 @@
 """Lib Level Manager"""
+from array import array
+from bisect import bisect_right
+from random import Random
+from typing import Any, NamedTuple, Sequence
 try:
-    from .libshared import percentage
-except (ModuleNotFoundError, ImportError):
-    from libshared import percentage
-from functools import lru_cache
-from math import inf
-from random import randint
-from pprint import pprint
-
-@lru_cache
+    import numpy as _numpy
+except ImportError:
+    _numpy = None
+
+# Largest EXP of a level (or a total); the curve saturates here.
+EXP_LIMIT = 2**63-1
+
+
+def _growth(rng: Random, level: int) -> int:
+    """Percent of EXP a level needs over the previous one"""
+    if level <= 30:
+        return rng.randint(1, 5)
+    if level % 200 != 0:
+        return rng.randint(5, 10)
+    return rng.randint(round(20+level/300), round(30+level/300))
+
+
+class LevelUps(NamedTuple):
+    """Result of LevelManager.award(); one item per character.
+    These are array('q') or, on the NumPy path, int64 ndarrays."""
+    levels: Any
+    exp: Any  # EXP left toward the next level
+    level_ups: Any
+
+
+def _saturating_add(a, b):
+    """a+b of non-negative int64 ndarrays, capped at EXP_LIMIT"""
+    return a+_numpy.minimum(b, EXP_LIMIT-a)
+
+
+class LevelManager:
+    """EXP curve of levels 0..max_level-1, drawn from seed; the same seed makes the same curve everywhere.
+
+    exp_for_level(n) is EXP needed to go from level n to n+1. Totals are EXP needed to reach
+    a level from level 0, level_for_exp() searches them. The curve ends before the first total that
+    reaches EXP_LIMIT, so max_level may be lower than asked for."""
+    __slots__ = ('_seed', '_exp', '_totals')
+
+    def __init__(self, seed: int = 0, max_level: int = 10000, base: int = 40):
+        if max_level < 1:
+            raise ValueError("max_level must be at least 1")
+        self._seed = seed
+        rng = Random(seed)
+        exp = array('q', [EXP_LIMIT])*max_level
+        totals = array('q', [EXP_LIMIT])*max_level
+        need = base
+        total = 0
+        for level in range(max_level):
+            if level:
+                # Same as percentage(p)(need), rounded like the old _debug_level_to_exp()
+                need = min(round(round(need*(_growth(rng, level)/100))+need), EXP_LIMIT)
+            if total == EXP_LIMIT:
+                # Saturated; this level and the ones above can't be told apart, so they can't be reached
+                del exp[level:], totals[level:]
+                break
+            exp[level] = need
+            totals[level] = total
+            total = min(total+need, EXP_LIMIT)
+        self._exp = exp
+        self._totals = totals
+
+    @property
+    def seed(self) -> int:
+        return self._seed
+
+    @property
+    def max_level(self) -> int:
+        return len(self._exp)
+
+    def _check(self, level: int):
+        if not 0 <= level < len(self._exp):
+            raise ValueError(f"Level {level} is out of 0..{len(self._exp)-1}")
+
+    def exp_for_level(self, level: int) -> int:
+        """Return EXP needed to go from level to level+1"""
+        self._check(level)
+        return self._exp[level]
+
+    def total_exp(self, level: int) -> int:
+        """Return EXP needed to reach level from level 0"""
+        self._check(level)
+        return self._totals[level]
+
+    def level_for_exp(self, exp: int) -> int:
+        """Return the level reached with a total of exp from level 0"""
+        if exp < 0:
+            raise ValueError("exp must not be negative")
+        return bisect_right(self._totals, exp)-1
+
+    def award(self, levels: Sequence[int], exp: Sequence[int], gains: Sequence[int],
+              use_numpy: bool = None) -> LevelUps:
+        """Give gains of EXP to many characters at once. levels and exp are their current level and EXP
+        toward the next level (like Profile._state). Uses NumPy when it's installed, unless use_numpy is False."""
+        if not len(levels) == len(exp) == len(gains):
+            raise ValueError("levels, exp and gains must have the same length")
+        if use_numpy is None:
+            use_numpy = _numpy is not None
+        if use_numpy:
+            return self._award_numpy(levels, exp, gains)
+        totals = self._totals
+        last = len(totals)-1
+        new_levels = array('q')
+        left = array('q')
+        level_ups = array('q')
+        for level, current, gain in zip(levels, exp, gains):
+            if not 0 <= level <= last:
+                raise ValueError(f"Level {level} is out of 0..{last}")
+            if current < 0 or gain < 0:
+                raise ValueError("exp and gains must not be negative")
+            total = min(totals[level]+current+gain, EXP_LIMIT)
+            new = bisect_right(totals, total, level)-1
+            new_levels.append(new)
+            left.append(total-totals[new])
+            level_ups.append(new-level)
+        return LevelUps(new_levels, left, level_ups)
+
+    def _award_numpy(self, levels, exp, gains) -> LevelUps:
+        if _numpy is None:
+            raise ModuleNotFoundError("NumPy is not installed")
+        np = _numpy
+        totals = np.frombuffer(self._totals, dtype=np.int64)
+        levels = np.asarray(levels, dtype=np.int64)
+        if levels.size and (levels.min() < 0 or levels.max() >= len(totals)):
+            raise ValueError(f"Levels must be in 0..{len(totals)-1}")
+        exp = np.asarray(exp, dtype=np.int64)
+        gains = np.asarray(gains, dtype=np.int64)
+        if (exp.size and exp.min() < 0) or (gains.size and gains.min() < 0):
+            raise ValueError("exp and gains must not be negative")
+        total = _saturating_add(_saturating_add(totals[levels], exp), gains)
+        new_levels = np.searchsorted(totals, total, side='right')-1
+        return LevelUps(new_levels, total-totals[new_levels], new_levels-levels)
+
+    def __repr__(self):
+        return f"LevelManager(seed={self._seed}, max_level={len(self._exp)})"
+
+
+_default: LevelManager = None
+
+
+def default_manager() -> LevelManager:
+    """Return the shared LevelManager (seed 0), made on first use"""
+    global _default
+    if _default is None:
+        _default = LevelManager()
+    return _default
+
+
 def _debug_level_to_exp(level: int) -> int:
-    if level == 0:
-        return 40
-    try:
-        return round(round(percentage(randint(1,5) if level <= 30 else (randint(round(5), round(10)) if (level % 200) != 0 else (randint(round(20+level/300), round(30+level/300)))))(_debug_level_to_exp(level-1)))+_debug_level_to_exp(level-1))
-    except Exception:
-        return inf
-
-x = [(_debug_level_to_exp(a),a) for a in range(10000)]
-pprint(x)
\ No newline at end of file
+    return default_manager().exp_for_level(level)
+
+
+def _main():
+    from pprint import pprint
+    manager = default_manager()
+    pprint([(manager.exp_for_level(a), a) for a in range(0, manager.max_level, 500)])
+    assert manager.level_for_exp(manager.total_exp(42)) == 42
+    assert manager.level_for_exp(manager.total_exp(42)-1) == 41
+    assert LevelManager(7).exp_for_level(100) == LevelManager(7).exp_for_level(100)
+    assert manager.level_for_exp(EXP_LIMIT) == manager.max_level-1 < 10000
+    result = manager.award([0, 3], [0, 10], [manager.total_exp(5), 0])
+    assert list(result.levels) == [5, 3] and list(result.level_ups) == [5, 0]
+
+
+if __name__ == '__main__':
+    _main()
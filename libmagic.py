@@ -4,7 +4,7 @@ from configparser import ConfigParser
 from dataclasses import dataclass
 from posixpath import exists, realpath, splitext
 from typing import Any, Literal, Mapping, Union
-from libsavestate import DataUnpickler
+from libsavestate import SaveCodec, save_writer
 from libpostreq import yaml_installed
 from libshared import DataPath, load, parse
 
@@ -36,25 +36,22 @@ class MagicPath(DataPath, prefix='magic'):
                     raise Exception("The expected arguments are minimal")
                 name = a['DEFAULTS']['name']
                 type = a['DEFAULTS']['type']
-                speciality = a['DEFAULTS']['speciality'] if fs == 0 else a['speciality']
+                speciality = a['speciality'] if fs == 0 else a['DEFAULTS']['speciality']
                 return MagicType(name, type, speciality)
             raise Exception("Unrecognized extention: %s" % x[1][1:])
-        with open(x, 'rb') as f:
-            return DataUnpickler.unload(f.read())
+        return self.read_compiled()
 
     def save(self, magic: MagicType):
         x = splitext(self.read_path())
         if self.config.get("compiled", False) is True:
-            with open(x, 'wb') as f:
-                return f.write(DataUnpickler.dumps(magic))
+            return save_writer.write(self.read_path(), SaveCodec.dumps(magic))
         if x[1] == '.yaml':
             a = {
                 "name": magic.name,
                 "type": magic.type,
                 "speciality": magic.speciality
             }
-            with open(self.read_path(), 'w') as f:
-                return f.write(parse(a, 'yaml'))
+            return save_writer.write(self.read_path(), parse(a, 'yaml'))
         if x[1] == '.ini':
             a = ConfigParser({
                 "name": magic.name,
@@ -62,8 +59,7 @@ class MagicPath(DataPath, prefix='magic'):
             })
             a.add_section("speciality")
             a['speciality'].update(magic.speciality)
-            with open(self.read_path(), 'w') as f:
-                return f.write(parse(a, 'ini'))
+            return save_writer.write(self.read_path(), parse(a, 'ini'))
         raise Exception("Unrecognized extention: %s" % x[1][1:])
 
 
@@ -87,5 +83,8 @@ class MagicType:
         return a.read()
 
 
+SaveCodec.register(12, MagicType, ('name', 'type', 'speciality'))
+
+
 def _main():
     pass
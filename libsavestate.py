@@ -5,8 +5,15 @@
 # Avoid problems is better than solving problems.
 
 from pickle import Unpickler, UnpicklingError, dumps
-from typing import Any, Union
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Sequence, Tuple, Union
 from io import BytesIO
+from os import O_RDONLY, close, fstat, fsync, makedirs, open as os_open, replace, walk
+from os.path import dirname, join, relpath, sep, splitext
+from struct import Struct, error as struct_error
+from mmap import mmap, ACCESS_READ
+from collections import OrderedDict
+from threading import Condition, Thread
+import atexit
 
 
 class PickleFileError(Exception):
@@ -31,33 +38,601 @@ class ReturnState(Unpickler):
         return cls(BytesIO(data)).load()
 
 
+# Globals a save file may refer to. Anything else is refused.
+# Inventories and profiles are not here; their pickles don't fit the classes anymore.
+_safe_globals = {
+    'libchara': {'Character'},
+    'libmagic': {'MagicType'},
+    'libitems': {'ItemType'},
+    'libshared': {'ConstCreator', 'PUID', '_restore_puid', 'percentage', 'RODictProxy',
+                  'Protocol', 'Project', 'AssetPath', 'DataPath'},
+    'builtins': {'bytearray', 'set', 'frozenset', 'complex'},
+    'array': {'array', '_array_reconstructor'},
+    'collections': {'OrderedDict'},
+}
+
+
 class DataUnpickler(ReturnState):
 
     def find_class(self, module: str, name: str) -> Any:  # Too many UNIONS!!
-        try:
-            return super().find_class(module, name)
-        except UnpicklingError:
-            if module not in ("libchara", 'libgame', 'libinventory', 'liblocalisation', 'libmagic', 'libshared'):
-                raise
-            if name not in ("ConstCreator", "PUID", 'percentage', 'Protocol', 'Project', 'AssetPath', 'DataPath', 'Character', 'Profile', 'Inventory', "ItemType", "MagicType"):
-                raise
-            return super().find_class(module, name)
+        if name not in _safe_globals.get(module, ()):
+            raise UnpicklingError(f"global '{module}.{name}' is forbidden")
+        return super().find_class(module, name)
 
     @staticmethod
     def dumps(data: Any) -> bytes:
         return dumps(data)
 
-def compile_data():
-    from libshared import Protocol
-    # XXX: On certain classes. A URL Scheme with query of ?type=compiled
-    #      Should move the read_path value to some other things.
-    #      data-source on default then
-    #      data on compiled
-    #      Loading on data-source should be forbidden.
-    #      Aside that, on global install; data-source will be hidden.
+
+# =================================================================
+
+#                       Save codec
+
+# =================================================================
+
+# Layout: magic, format version, then one value. A value is a 1-byte kind, then:
+#   N/T/F   (None/True/False) nothing
+#   i       zigzag varint
+#   f       float64
+#   s/b     varint length, UTF-8/raw bytes
+#   l/t     varint count, values (list/tuple)
+#   d       varint count, key and value pairs
+#   o       varint type tag, varint field count, field values (see SaveCodec.register)
+#   r       varint; the n-th decoded o value again (the same object is encoded once)
+
+class CodecError(Exception):
+    """The data can't be encoded/decoded by SaveCodec."""
+
+
+_codec_magic = b'RPGS'
+_codec_version = 1
+_float = Struct('<d')
+
+
+# Deepest nesting of containers and objects; deeper data is refused on both sides
+# instead of running into the recursion limit.
+_max_depth = 200
+
+
+def _dumps(obj: Any, types: Dict[type, Tuple[int, type, Callable, Callable]]) -> bytes:
+    """Encode obj after the magic and format version"""
+    out = bytearray(_codec_magic)
+    out.append(_codec_version)
+    append = out.append
+    extend = out.extend
+    # id(object) -> (its order in o values, object); objects are kept alive so ids stay unique
+    memo: Dict[int, Tuple[int, Any]] = {}
+    strings: Dict[str, bytes] = {}  # str -> its encoded value
+
+    def uint(n: int):
+        while n > 0x7f:
+            append((n & 0x7f) | 0x80)
+            n >>= 7
+        append(n)
+
+    def encode(obj: Any, depth: int):
+        kind = type(obj)
+        if kind is int:
+            append(0x69)
+            n = obj << 1 if obj >= 0 else ((-obj-1) << 1) | 1
+            if n < 0x80:
+                append(n)
+            else:
+                uint(n)
+            return
+        if kind is str:
+            chunk = strings.get(obj)
+            if chunk is None:
+                data = obj.encode()
+                head = bytearray(b's')
+                n = len(data)
+                while n > 0x7f:
+                    head.append((n & 0x7f) | 0x80)
+                    n >>= 7
+                head.append(n)
+                chunk = strings[obj] = bytes(head)+data
+            extend(chunk)
+            return
+        if obj is None:
+            append(0x4e)
+            return
+        if kind is bool:
+            append(0x54 if obj else 0x46)
+            return
+        if kind is float:
+            append(0x66)
+            extend(_float.pack(obj))
+            return
+        if kind is bytes:
+            append(0x62)
+            uint(len(obj))
+            extend(obj)
+            return
+        if depth > _max_depth:
+            raise CodecError(f"Data is nested deeper than {_max_depth}")
+        depth += 1
+        if kind is list or kind is tuple:
+            append(0x6c if kind is list else 0x74)
+            uint(len(obj))
+            for value in obj:
+                encode(value, depth)
+        elif kind is dict:
+            append(0x64)
+            uint(len(obj))
+            for key, value in obj.items():
+                encode(key, depth)
+                encode(value, depth)
+        else:
+            seen = memo.get(id(obj))
+            if seen is not None:
+                append(0x72)
+                if seen[0] < 0x80:
+                    append(seen[0])
+                else:
+                    uint(seen[0])
+                return
+            schema = types.get(kind)
+            if schema is None:
+                raise CodecError(f"{kind.__name__} is not registered to SaveCodec")
+            fields = schema[2](obj)
+            append(0x6f)
+            uint(schema[0])
+            if len(fields) < 0x80:
+                append(len(fields))
+            else:
+                uint(len(fields))
+            for value in fields:
+                encode(value, depth)
+            # Numbered after its fields, as the decoder does
+            memo[id(obj)] = (len(memo), obj)
+
+    encode(obj, 0)
+    return bytes(out)
+
+
+def _loads(data: bytes, tags: Dict[int, Tuple[int, type, Callable, Callable]]) -> Any:
+    """Decode the value after the magic and format version. Errors of malformed data are left to the caller."""
+    pos = 5
+    end = len(data)
+    objects: List[Any] = []
+
+    def uint() -> int:
+        nonlocal pos
+        n = shift = 0
+        while True:
+            byte = data[pos]
+            pos += 1
+            n |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return n
+            shift += 7
+
+    def raw() -> bytes:
+        nonlocal pos
+        size = data[pos]
+        if size > 0x7f:
+            size = uint()
+        else:
+            pos += 1
+        start = pos
+        pos += size
+        if pos > end:
+            raise IndexError
+        return data[start:pos]
+
+    def value(depth: int) -> Any:
+        nonlocal pos
+        kind = data[pos]
+        pos += 1
+        if kind == 0x69:  # i
+            n = data[pos]
+            if n > 0x7f:
+                n = uint()
+            else:
+                pos += 1
+            return n >> 1 if not n & 1 else -(n >> 1)-1
+        if kind == 0x73:  # s
+            return raw().decode()
+        if kind == 0x72:  # r
+            n = data[pos]
+            if n > 0x7f:
+                n = uint()
+            else:
+                pos += 1
+            try:
+                return objects[n]
+            except IndexError:
+                raise CodecError("Reference to undecoded object") from None
+        if kind == 0x4e:  # N
+            return None
+        if kind == 0x54:  # T
+            return True
+        if kind == 0x46:  # F
+            return False
+        if kind == 0x66:  # f
+            pos += 8
+            if pos > end:
+                raise IndexError
+            return _float.unpack_from(data, pos-8)[0]
+        if kind == 0x62:  # b
+            return bytes(raw())
+        if depth > _max_depth:
+            raise CodecError(f"Data is nested deeper than {_max_depth}")
+        depth += 1
+        if kind == 0x6f:  # o
+            tag = data[pos]
+            if tag > 0x7f:
+                tag = uint()
+            else:
+                pos += 1
+            schema = tags.get(tag)
+            if schema is None:
+                raise CodecError(f"Unknown type tag {tag}")
+            count = data[pos]
+            if count > 0x7f:
+                count = uint()
+            else:
+                pos += 1
+            obj = schema[3]([value(depth) for _ in range(count)])
+            objects.append(obj)
+            return obj
+        if kind == 0x6c:  # l
+            return [value(depth) for _ in range(uint())]
+        if kind == 0x74:  # t
+            return tuple([value(depth) for _ in range(uint())])
+        if kind == 0x64:  # d
+            return {value(depth): value(depth) for _ in range(uint())}
+        raise CodecError(f"Unknown value kind {kind:#x} at {pos-1}")
+
+    obj = value(0)
+    if pos != end:
+        raise CodecError("Trailing data after save codec data")
+    return obj
+
+
+class SaveCodec:
+    """Versioned binary codec of save data.
+    Only plain data (None, bool, int, float, str, bytes, list, tuple, dict) and registered types are accepted;
+    everything else is refused on both encoding and decoding.
+
+    lib* modules register their own types, e.g.:
+    >>> SaveCodec.register(10, Character, ('name', 'gender', 'race', 'age'))"""
+    # type -> (tag, type, encode, decode); tag -> the same
+    _types: Dict[type, Tuple[int, type, Callable, Callable]] = {}
+    _tags: Dict[int, Tuple[int, type, Callable, Callable]] = {}
+
+    @classmethod
+    def register(cls, tag: int, type_: type, fields: Sequence[str] = None,
+                 encode: Callable[[Any], Sequence[Any]] = None, decode: Callable[[List[Any]], Any] = None):
+        """Register a type. Either give its fields (encoded by name; decoded as type_(*values))
+        or encode (object -> field values) and decode (field values -> object).
+        Tags are part of the file format; never reuse one."""
+        if tag in cls._tags and cls._tags[tag][1] is not type_:
+            raise CodecError(f"Tag {tag} is already used by {cls._tags[tag][1].__name__}")
+        if fields is not None:
+            def encode(obj, fields=tuple(fields)):
+                return [getattr(obj, name) for name in fields]
+
+            def decode(values):
+                return type_(*values)
+        if encode is None or decode is None:
+            raise TypeError("Either fields or encode and decode are required")
+        cls._types[type_] = cls._tags[tag] = (tag, type_, encode, decode)
+
+    @classmethod
+    def dumps(cls, obj: Any) -> bytes:
+        """Encode obj"""
+        return _dumps(obj, cls._types)
+
+    @classmethod
+    def unload(cls, data: bytes) -> Any:
+        """Decode data made by dumps(). Malformed data raises CodecError."""
+        if data[:4] != _codec_magic:
+            raise CodecError("Not a save codec data")
+        if len(data) < 6:
+            raise CodecError("Truncated save codec data")
+        if data[4] != _codec_version:
+            raise CodecError(f"Unsupported save codec version {data[4]}")
+        try:
+            return _loads(data, cls._tags)
+        except CodecError:
+            raise
+        except IndexError:
+            raise CodecError("Truncated save codec data") from None
+        except Exception as exc:  # Bad field values of a type, unhashable keys, bad UTF-8...
+            raise CodecError(f"Malformed save codec data ({type(exc).__name__}: {exc})") from exc
+
+
+def load_state(data: bytes) -> Any:
+    """Decode a save; SaveCodec data, or a (restricted) pickle made before it.
+    Pickled characters, items, magic and PUIDs load; pickled inventories and profiles are refused."""
+    if data[:4] == _codec_magic:
+        return SaveCodec.unload(data)
+    return DataUnpickler.unload(data)
+
+def _fsync_dir(path: str):
+    """Make a rename in path durable. Not every platform can open a directory; those are skipped."""
+    try:
+        fd = os_open(path or '.', O_RDONLY)
+    except OSError:
+        return
+    try:
+        fsync(fd)
+    except OSError:
+        pass
+    finally:
+        close(fd)
+
+
+def write_atomic(path: str, data: bytes):
+    """Replace path with data. A crash leaves either the old or the new file, never a truncated one."""
+    with open(path+'.tmp', 'wb') as f:
+        f.write(data)
+        f.flush()
+        fsync(f.fileno())
+    replace(path+'.tmp', path)
+    _fsync_dir(dirname(path))
+
+
+def write_append(path: str, data: bytes):
+    """Append data to path. Readers must tolerate a truncated tail (see libgame journals)."""
+    with open(path, 'ab') as f:
+        f.write(data)
+        f.flush()
+        fsync(f.fileno())
+
+
+class SaveWriter:
+    """Background writer of save files.
+
+    Writes are done in order on one thread. A write to a path that's still queued replaces it (the last
+    save wins); appends to a queued path are joined. A failed write is raised by wait() of its path or
+    by flush(); it never stops other paths from being written."""
+
+    def __init__(self):
+        # path -> (append, data), in the order they're written
+        self._pending: Dict[str, Tuple[bool, bytes]] = {}
+        self._writing: str = None
+        # path -> error of its first failed write, until wait() raises it
+        self._errors: Dict[str, BaseException] = {}
+        self._lock = Condition()
+        self._thread: Thread = None
+
+    def write(self, path: str, data: Union[str, bytes], append: bool = False) -> int:
+        """Queue data to be written (or appended) into path. Return the length of data."""
+        if isinstance(data, str):
+            data = data.encode()
+        size = len(data)
+        with self._lock:
+            old = self._pending.pop(path, None)
+            if append and old is not None:
+                append, data = old[0], old[1]+data
+            self._pending[path] = (append, data)
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='SaveWriter', daemon=True)
+                self._thread.start()
+            self._lock.notify_all()
+        return size
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._pending:
+                    self._lock.wait()
+                path = next(iter(self._pending))
+                append, data = self._pending.pop(path)
+                self._writing = path
+            try:
+                (write_append if append else write_atomic)(path, data)
+            except BaseException as exc:  # Handed to the caller of wait(path)/flush()
+                with self._lock:
+                    self._errors.setdefault(path, exc)
+            finally:
+                with self._lock:
+                    self._writing = None
+                    self._lock.notify_all()
+
+    def wait(self, path: str = None):
+        """Block until path (or everything, when None) is written. Raise the error of a failed write to it."""
+        with self._lock:
+            if path is None:
+                while self._pending or self._writing is not None:
+                    self._lock.wait()
+                if self._errors:
+                    raise self._errors.pop(next(iter(self._errors)))
+            else:
+                while path in self._pending or self._writing == path:
+                    self._lock.wait()
+                if path in self._errors:
+                    raise self._errors.pop(path)
+
+    flush = wait
+
+
+save_writer = SaveWriter()
+atexit.register(save_writer.flush)
+
+
+class BundleError(Exception):
+    """The file is not an asset bundle, or the asset is not in it."""
+
+
+# Bundle layout:
+#   header: magic, version, entry count
+#   index:  per entry; name length, offset (from the end of index), data length, name (UTF-8)
+#   data:   SaveCodec.dumps() of every asset
+_bundle_header = Struct('<4sBI')
+_bundle_entry = Struct('<HQI')
+_bundle_magic = b'RPGB'
+_bundle_version = 2
+
+
+def bundle_key(path: str) -> str:
+    """Return the name an asset path is stored with in a bundle; the path without extension."""
+    return splitext(path.lstrip('/'))[0]
+
+
+def _read_bundle_index(path: str, data: bytes) -> Dict[str, Tuple[int, int]]:
+    """Return {name: (position, length)} of assets in bundle data. Raise BundleError when it's malformed."""
+    if len(data) < _bundle_header.size:
+        raise BundleError(f"{path} is not an asset bundle")
+    magic, version, count = _bundle_header.unpack_from(data)
+    if magic != _bundle_magic or version != _bundle_version:
+        raise BundleError(f"{path} is not an asset bundle (version {_bundle_version})")
+    entries = []
+    pos = _bundle_header.size
+    try:
+        for _ in range(count):
+            size, offset, length = _bundle_entry.unpack_from(data, pos)
+            pos += _bundle_entry.size
+            name = data[pos:pos+size]
+            if len(name) != size:
+                raise BundleError(f"{path} is truncated in its index")
+            entries.append((name.decode(), offset, length))
+            pos += size
+    except (struct_error, UnicodeDecodeError) as exc:
+        raise BundleError(f"{path} has a malformed index: {exc}") from None
+    # pos is now the start of data
+    index = {}
+    for name, offset, length in entries:
+        if pos+offset+length > len(data):
+            raise BundleError(f"{path} is truncated; {name} is past its end")
+        index[name] = (pos+offset, length)
+    return index
+
+
+class AssetBundle:
+    """Compiled assets of a prefix (items, magic, chara), packed in one file.
+    Use AssetBundle.open() to share the opened bundles.
+
+    The file is memory-mapped; only its index stays in memory. Assets are decoded on first get()
+    and the last cache_size of them are kept (decoded assets are shared, don't edit them)."""
+    _opened: Dict[str, 'AssetBundle'] = {}
+
+    def __init__(self, path: str, cache_size: int = 256):
+        self._path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap(self._file.fileno(), 0, access=ACCESS_READ)
+        except ValueError:  # Empty file can't be mapped
+            self._file.close()
+            raise BundleError(f"{path} is not an asset bundle") from None
+        # When the bundle was written; see DataPath.read_compiled()
+        self.mtime = fstat(self._file.fileno()).st_mtime_ns
+        self._cache: 'OrderedDict[str, Any]' = OrderedDict()
+        self._cache_size = cache_size
+        try:
+            self._index = _read_bundle_index(path, self._map)
+        except BundleError:
+            self.close()
+            raise
+
+    @classmethod
+    def open(cls, path: str, cache_size: int = 256) -> 'AssetBundle':
+        """Return the bundle in path, opened once. cache_size is used by the first open."""
+        bundle = cls._opened.get(path)
+        if bundle is None:
+            bundle = cls._opened[path] = cls(path, cache_size)
+        return bundle
+
+    @classmethod
+    def forget(cls, path: str = None):
+        """Close and drop opened bundle of path (or all of them)."""
+        if path is None:
+            for bundle in cls._opened.values():
+                bundle.close()
+            cls._opened.clear()
+            return
+        bundle = cls._opened.pop(path, None)
+        if bundle is not None:
+            bundle.close()
+
+    def close(self):
+        """Unmap and close the bundle file"""
+        self._cache.clear()
+        self._map.close()
+        self._file.close()
+
+    def get(self, name: str) -> Any:
+        """Load an asset by its name"""
+        cache = self._cache
+        if name in cache:
+            cache.move_to_end(name)
+            return cache[name]
+        try:
+            offset, length = self._index[name]
+        except KeyError:
+            raise BundleError(f"{name} is not in {self._path}") from None
+        try:
+            asset = SaveCodec.unload(self._map[offset:offset+length])
+        except CodecError as exc:
+            raise BundleError(f"{name} in {self._path} is malformed: {exc}") from None
+        cache[name] = asset
+        if len(cache) > self._cache_size:
+            cache.popitem(last=False)
+        return asset
+
+    def names(self) -> Iterable[str]:
+        return self._index.keys()
+
+    def __contains__(self, name: str):
+        return name in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    @staticmethod
+    def write(path: str, assets: Mapping[str, Any]) -> int:
+        """Write assets ({name: asset}) into a bundle in path"""
+        blobs = []
+        index = []
+        offset = 0
+        for name, asset in assets.items():
+            blob = SaveCodec.dumps(asset)
+            encoded = name.encode()
+            index.append(_bundle_entry.pack(len(encoded), offset, len(blob))+encoded)
+            blobs.append(blob)
+            offset += len(blob)
+        data = b''.join([_bundle_header.pack(_bundle_magic, _bundle_version, len(blobs))]+index+blobs)
+        makedirs(dirname(path), exist_ok=True)
+        AssetBundle.forget(path)  # An opened (mapped) file can't be replaced everywhere
+        write_atomic(path, data)
+        return len(data)
+
+
+def _read_source(prefix: str, path: str) -> Any:
+    """Load an asset from data-source/<prefix>/<path>"""
+    if prefix == 'items':
+        from libitems import ItemPath
+        return ItemPath(f"items://{path}").read()
+    if prefix == 'magic':
+        from libmagic import MagicPath
+        return MagicPath(f"magic://{path}").read()
+    # Characters don't have a source format yet; they're saved as is.
+    from libshared import getpath
+    with open(join(getpath(), 'data-source', prefix, path), 'rb') as f:
+        return load_state(f.read())
+
+
+def compile_data(prefixes: Iterable[str] = ('items', 'magic', 'chara')) -> Dict[str, int]:
+    """Compile every asset in data-source/<prefix>/ into data/<prefix>.bundle.
+    Return {prefix: number of compiled assets}."""
+    from libshared import getpath
+    save_writer.flush()
+    # XXX: Aside that, on global install; data-source will be hidden.
     #      That means, it must be some sort of flags of global install.
-    #      Or, we shouldn't just do that.
-    pass
+    root = getpath()
+    x = {}
+    for prefix in prefixes:
+        source = join(root, 'data-source', prefix)
+        assets = {}
+        for dirpath, _, files in walk(source):
+            for file in sorted(files):
+                path = relpath(join(dirpath, file), source).replace(sep, '/')
+                assets[bundle_key(path)] = _read_source(prefix, path)
+        AssetBundle.write(join(root, 'data', prefix+'.bundle'), assets)
+        x[prefix] = len(assets)
+    return x
 
 def _main():
     from pickle import dumps
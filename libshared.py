@@ -8,25 +8,37 @@ __version__ = '0.0.1 [A1]'
 __author__ = 'Archaent Nakasaki and RimuEirnarn'
 __copyright__ = 'BSD 3-Clause'
 __all__ = ['ConstCreator', 'PUID', 'make_uuid', 'RandomNamespace',
-           'AssignedProtocolError', 'Protocol', "Project", 'AssetPath', 'DataPath', 'getpath']
+           'AssignedProtocolError', 'Protocol', "Project", 'AssetPath', 'DataPath', 'getpath',
+           'invalidate_paths']
 
 from hashlib import sha256 as _hs_256
 from io import StringIO
+from os import stat
 from os.path import exists, expanduser, realpath
 from re import compile as _re_compile, escape as _re_escape
 from secrets import SystemRandom
 from string import punctuation
+from types import MappingProxyType
 from typing import (IO, Any, Callable, Dict, Iterable, List, Literal, Mapping,
-                    Union)
-from urllib.parse import urlsplit, parse_qs
+                    NamedTuple, Union)
+from urllib.parse import urlencode, urlsplit, parse_qs
 from uuid import UUID as system_UUID
 from uuid import uuid5
 from inspect import currentframe as _icf, getframeinfo as _igfi
 from ast import parse as _astparse
+from functools import lru_cache, wraps
 from platform import system
 from random import Random
 from json import loads as json_loads
 from warnings import warn
+from weakref import WeakValueDictionary
+from os.path import splitext
+from libsavestate import AssetBundle, CodecError, SaveCodec, bundle_key, load_state, save_writer
+
+try:
+    import yaml as _yaml
+except ImportError:
+    _yaml = None
 from configparser import ConfigParser
 
 _uuid_max_int = 340282366920938463463374607431768211455
@@ -62,6 +74,17 @@ def _cast(data: str):
         return data
 
 
+def _uncast(data: Any) -> str:
+    # Reverse of _cast, for building a query
+    if data is True:
+        return 'true'
+    if data is False:
+        return 'false'
+    if data is None:
+        return 'none'
+    return str(data)
+
+
 class ConstCreator:
     """Constant Creator"""
     _objects: Dict[str, ConstCreator] = {}
@@ -124,6 +147,16 @@ class ConstCreator:
 _MISSING = ConstCreator()
 
 
+def _decode_const(values) -> ConstCreator:
+    try:
+        return ConstCreator._objects[values[0]]
+    except KeyError:
+        raise CodecError(f"Undefined constant: {values[0]}") from None
+
+
+SaveCodec.register(1, ConstCreator, encode=lambda self: (self._name,), decode=_decode_const)
+
+
 class RODictProxy:
     """Read only dict object proxy"""
     def __init_subclass__(cls) -> None:
@@ -228,16 +261,43 @@ def _puid_to_int(chars: str):
     return int(chars, 36)
 
 
+_pairs = tuple(a+b for a in _chars for b in _chars)
+
+
 def _int_to_spuid(n: int):
-    # how we do this?
-    array = []
+    # Exact for any size; two digits per step, no float division.
     if n == 0:
         return '0'
-    while n != 0:
-        check = n % len(_chars)
-        array.append(_chars[check])
-        n = int(n/len(_chars))
-    return ''.join(reversed(array))
+    array = []
+    while n:
+        n, check = divmod(n, 1296)
+        array.append(_pairs[check])
+    return ''.join(reversed(array)).lstrip('0')
+
+
+def _normalise(value: int, low: int, high: int) -> int:
+    """Bring a digest sum into [low, high].
+    Same as doubling it until it reaches low (then cutting quarters of the sum until it's under high)."""
+    original = value
+    value <<= ((low+value-1)//value - 1).bit_length() if value < low else 0
+    while value > high:
+        value -= original//4
+    return value
+
+
+def _digest_sum(data: str) -> int:
+    return sum(_hs_256(data.encode()).digest())
+
+
+_random = SystemRandom()
+_puid_state = ('_multiple_ns', '_ns_root', '_ns_body',
+               '_name', '_puid', '_version', '_int')
+_interned: 'WeakValueDictionary[str, PUID]' = WeakValueDictionary()
+_namespaces: Dict[str, PUID] = {}
+_min4 = 46656
+_max4 = 1679615
+_min8 = 221073919720733357899776
+_max8 = 7958661109946400884391935
 
 
 class PUID:
@@ -252,45 +312,30 @@ class PUID:
 
     # Namespace creation:
     # 0 - Namespace name (4 chars)
+    __slots__ = _puid_state+('__weakref__',)
+
     def __init__(self, name: Union[str, int, Iterable[Union[str, PUID]]], namespace: PUID = None, version: Literal[1, 2, 3, 4, 'int0', 'int1'] = 1):
-        _min4 = 46656
-        _max4 = 1679615
-        _min8 = 221073919720733357899776
-        _max8 = 7958661109946400884391935
         self._multiple_ns = None
         self._ns_root = None
+        self._name = None
+        self._version = version
+        self._int = None  # as_int; computed on first use
         if version == 1:
             if namespace is None:
                 raise TypeError(
                     f"Expecting namespace to be PUID, but got {type(namespace)}")
             self._ns_root = namespace
             _ns = _puid_compiled.sub('', name.lower())
-            self._ns_body = sum(
-                _hs_256((namespace.body+_ns).encode()).digest())
-            _onsbd = self._ns_body
-            while self._ns_body < _min4:
-                self._ns_body *= 2
-            while self._ns_body > _max4:
-                self._ns_body -= int(_onsbd/4)
-            self._ns_body = _int_to_spuid(self._ns_body)
+            self._ns_body = _int_to_spuid(_normalise(
+                _digest_sum(namespace.body+_ns), _min4, _max4))
             self._name = name
         elif version == 2:
-            self._ns_root = None
-            _min = 221073919720733357899776
-            _max = 7958661109946400884391935
-            _nran = SystemRandom((_min+_max)*500)
-            nspace = _nran.randint(_min, _max)
-            self._ns_body = _int_to_spuid(nspace)
+            self._ns_body = _int_to_spuid(_random.randint(_min8, _max8))
         elif version == 3:
             _ns = _puid_compiled.sub('', name.lower())
-            self._ns_body = sum(_hs_256((_ns).encode()).digest())
-            _onsbd = self._ns_body
+            self._ns_body = _int_to_spuid(
+                _normalise(_digest_sum(_ns), _min4, _max4))
             self._name = name
-            while self._ns_body < _min4:
-                self._ns_body *= 2
-            while self._ns_body > _max4:
-                self._ns_body -= int(_onsbd/4)
-            self._ns_body = _int_to_spuid(self._ns_body)
         elif version == 4:
             if not hasattr(name, '__iter__') and isinstance(name, str):
                 raise TypeError("Iterable[PUID] is required.")
@@ -298,39 +343,40 @@ class PUID:
             self._multiple_ns: Iterable[PUID] = name[:-1]
             if not isinstance(name[-1], str):
                 raise TypeError("The last of PUID should be int.")
-            _ns = name[-1]
-            _ns = _puid_compiled.sub('', _ns.lower())
-            self._ns_body = sum(_hs_256((_ns).encode()).digest())
-            _onsbd = self._ns_body
+            _ns = _puid_compiled.sub('', name[-1].lower())
+            self._ns_body = _int_to_spuid(
+                _normalise(_digest_sum(_ns), _min8, _max8))
             self._name = name
-            while self._ns_body < _min8:
-                self._ns_body *= 2
-            while self._ns_body > _max8:
-                self._ns_body -= int(_onsbd/4)
-            self._ns_body = _int_to_spuid(self._ns_body)
-            self._puid = '-'.join((a.body.upper()
-                                  for a in self._multiple_ns))+'-'+self._ns_body.upper()
         elif version == 'int0':
             if not isinstance(name, int):
                 raise TypeError('Version5: Name parameter should be integer.')
-            name: int = name
             self._ns_body = _int_to_spuid(name)
+            self._int = name
         elif version == 'int1':
             self._ns_root: PUID = name[0]
             self._multiple_ns: Iterable[PUID] = name[:-1]
             if not isinstance(name[-1], int):
                 raise TypeError("The last of PUID should be int.")
             self._ns_body = _int_to_spuid(name[-1])
-            self._puid = '-'.join(a.body.upper()
-                                  for a in self._multiple_ns)+'-'+self._ns_body.upper()
         else:
             raise Exception("Undefined version: %s" % version)
-        if self._ns_root is None:
+        if self._multiple_ns is not None:
+            self._puid = '-'.join(a.body.upper()
+                                  for a in self._multiple_ns)+'-'+self._ns_body.upper()
+        elif self._ns_root is None:
             self._puid = self._ns_body.upper()
-            return
-        self._ns_body: str = self._ns_body
-        self._puid = (self._ns_root.body+'-' +
-                      self._ns_body).upper() if version not in (4, 'int1') else self._puid
+        else:
+            self._puid = (self._ns_root.body+'-'+self._ns_body).upper()
+
+    def __setstate__(self, state):
+        # (None, slots) from this class; a plain dict from pickles made before __slots__
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        for name in _puid_state:
+            setattr(self, name, state.get(name))
+
+    def __reduce__(self):
+        return (_restore_puid, ({name: getattr(self, name) for name in _puid_state},))
 
     @property
     def root(self):
@@ -342,7 +388,9 @@ class PUID:
 
     @property
     def as_int(self):
-        return int(_puid_compiled.sub('', str(self).lower()), 36)
+        if self._int is None:
+            self._int = int(self._puid.replace('-', ''), 36)
+        return self._int
 
     @property
     def body(self):
@@ -350,11 +398,22 @@ class PUID:
 
     @property
     def fields(self):
-        return tuple(int()) if self._multiple_ns is not None else (int(self),)
+        if self._multiple_ns is None:
+            return (int(self),)
+        return tuple(int(a) for a in self._multiple_ns)+(int(self._ns_body, 36),)
+
+    @classmethod
+    def intern(cls, puid: PUID) -> PUID:
+        """Return the canonical instance of puid; the first live one interned with the same string."""
+        return _interned.setdefault(puid._puid, puid)
 
     @classmethod
     def make_namespace(cls, name: str):
-        return cls(name, version=3)
+        """Return namespace PUID of name. Built once per process."""
+        ns = _namespaces.get(name)
+        if ns is None:
+            ns = _namespaces[name] = cls.intern(cls(name, version=3))
+        return ns
 
     @classmethod
     def make_random(cls):
@@ -380,13 +439,25 @@ class PUID:
     def __int__(self):
         return self.as_int
 
+    def __hash__(self):
+        return hash(self._puid)
+
     def __eq__(self, other):
+        # Equal to its PUID string, and hashed like it; compare as_int to match an int.
         if isinstance(other, PUID):
             return self._puid == other._puid
         if isinstance(other, str):
             return self._puid == other
-        if isinstance(other, int):
-            return int(self) == other
+        return NotImplemented
+
+def _restore_puid(state: Dict[str, Any]) -> PUID:
+    """Unpickle a PUID, interned."""
+    self = PUID.__new__(PUID)
+    self.__setstate__(state)
+    return PUID.intern(self)
+
+SaveCodec.register(2, PUID, encode=lambda self: ({name: getattr(self, name) for name in _puid_state},),
+                   decode=lambda values: _restore_puid(values[0]))
 
 # Below here is mark of 'included' stuff from RimuEirnarn/GTRNv2
 # Also, edited in order to keep things good.
@@ -396,6 +467,50 @@ class AssignedProtocolError(Exception):
     """A prefix protocol is already defined"""
 
 
+class _ParsedURL(NamedTuple):
+    """Parsed protocol URL. config is read-only."""
+    scheme: str
+    path: str
+    config: Mapping[str, Any]
+
+
+@lru_cache(maxsize=4096)
+def _parse_url(url: str) -> _ParsedURL:
+    scheme, _, rest = url.partition("://")
+    query = urlsplit(url).query
+    config = {a: (_cast(b[0].lower()) if len(b) == 1 else tuple(_cast(
+        c.lower()) for c in b)) for a, b in parse_qs(query).items()}
+    # /path/to/dir?encoding=UTF-8 is a literal that not /path/to/dir and leaving query as config.
+    path = rest.partition('#')[0].partition('?')[0]
+    return _ParsedURL(scheme, path, MappingProxyType(config))
+
+
+# Resolved paths; see getpath(), _memo_path() and invalidate_paths()
+_root_path: str = None
+_path_cache: Dict[tuple, str] = {}
+
+
+def _memo_path(read_path: Callable[[Protocol], str]):
+    """Cache read_path() per protocol class and URL (see Protocol._key)"""
+    @wraps(read_path)
+    def wrapper(self):
+        if self._key is None:
+            return read_path(self)
+        key = (type(self), self._key)
+        path = _path_cache.get(key)
+        if path is None:
+            path = _path_cache[key] = read_path(self)
+        return path
+    return wrapper
+
+
+def invalidate_paths():
+    """Forget resolved paths. Call it after the App configuration path is created or removed."""
+    global _root_path
+    _root_path = None
+    _path_cache.clear()
+
+
 class Protocol:
     """Base Protocol class handler.
     You can use it like this:
@@ -421,14 +536,53 @@ class Protocol:
         return super().__new__(cls)
 
     def __init__(self, url: str):
+        parsed = _parse_url(url)
         self._url = url
-        self._splitted = urlsplit(url)
-        self._config = {a: (_cast(b[0].lower()) if len(b) == 1 else [_cast(
-            c.lower()) for c in b]) for a, b in parse_qs(self._splitted.query).items()}
+        self._key = url  # Of resolved paths, see _memo_path()
+        self._config = parsed.config
         self._roconfig = RODictProxy(self._config)
-        # /path/to/dir?encoding=UTF-8 is a literal that not /path/to/dir and leaving query as config.
-        self._path = url.partition(
-            "://")[2].replace(self._splitted.fragment, '').replace('?'+self._splitted.query, '')
+        self._path = parsed.path
+
+    @classmethod
+    def from_parts(cls, scheme: str, path: str, config: Mapping[str, Any] = None) -> Protocol:
+        """Make a protocol object from its parts, without parsing a URL."""
+        config = MappingProxyType({a: (tuple(b) if isinstance(b, list) else b)
+                                   for a, b in (config or {}).items()})
+        url = f"{scheme}://{path}"
+        if config:
+            url += '?'+urlencode({a: (tuple(map(_uncast, b)) if isinstance(b, (list, tuple)) else _uncast(b))
+                                 for a, b in config.items()}, doseq=True)
+        self = object.__new__(Protocol._prefix.get(scheme, cls))
+        self._url = url
+        parsed = _parse_url(url)
+        if parsed.path == path and parsed.config == config:
+            self._key = url
+        else:
+            # The URL parses into other parts (e.g. path holds '?' or '#'); it would share their resolved path
+            try:
+                self._key = (path, tuple(config.items()))
+                hash(self._key)
+            except TypeError:
+                self._key = None  # Not cached
+        self._config = config
+        self._roconfig = RODictProxy(config)
+        self._path = path
+        return self
+
+    @staticmethod
+    def resolve_many(urls: Iterable[str]) -> List[str]:
+        """Resolve many URLs into paths. Already resolved URLs are not parsed again."""
+        x = []
+        for url in urls:
+            cls = Protocol._prefix.get(url.partition("://")[0], Protocol)
+            path = _path_cache.get((cls, url))
+            if path is None:
+                proto = Protocol(url)
+                if not hasattr(proto, 'read_path'):
+                    raise TypeError(f"{url} can't be resolved into a path")
+                path = proto.read_path()
+            x.append(path)
+        return x
 
     def __repr__(self):
         return f"<{self.__class__.__name__}: {self._url}>"
@@ -455,9 +609,10 @@ class Project(Protocol, prefix='project', final=False):
             if self._path[0] == '/':
                 self._path = self._path[1:]
             return path+prefix+'/'+self._path
-        cls.read_path = read_path
+        cls.read_path = _memo_path(read_path)
         return super().__init_subclass__(prefix, final)
 
+    @_memo_path
     def read_path(self):
         path = getpath()
         if path[-1] == '/':
@@ -485,9 +640,10 @@ class AssetPath(Protocol, prefix='asset', final=False):
             if self._path[0] == '/':
                 self._path = self._path[1:]
             return path+'asset/'+prefix+'/'+self._path
-        cls.read_path = read_path
+        cls.read_path = _memo_path(read_path)
         return super().__init_subclass__(prefix, final)
 
+    @_memo_path
     def read_path(self):
         path = getpath()
         if path[-1] != '/':
@@ -503,8 +659,13 @@ class AssetPath(Protocol, prefix='asset', final=False):
 class DataPath(Protocol, prefix='data', final=False):
     """DataPath is the data protocol handler, contains items, etc.
     You can use like this:
-    >>> DataPath("data://items/idk.cmp")"""
+    >>> DataPath("data://items/idk.cmp")
+
+    Compiled (?compiled=true) assets are read from data/<prefix>.bundle when it exists (see libsavestate.compile_data)"""
+    _data_prefix: str = None
+
     def __init_subclass__(cls, /, prefix, compilable=True, default=0, final=True):
+        cls._data_prefix = prefix
         if compilable is True:
             def read_path(self):
                 path = getpath()
@@ -525,9 +686,10 @@ class DataPath(Protocol, prefix='data', final=False):
                 if self._path[0] == '/':
                     self._path = self._path[1:]
                 return path+_p+prefix+'/'+self._path
-        cls.read_path = read_path
+        cls.read_path = _memo_path(read_path)
         return super().__init_subclass__(prefix, final)
 
+    @_memo_path
     def read_path(self):
         path = getpath()
         _p = 'data-source/'
@@ -544,12 +706,47 @@ class DataPath(Protocol, prefix='data', final=False):
 
     @property
     def IsCompiled(self) -> bool:
-        return self._config("compiled", False)
+        return self._config.get("compiled", False)
+
+    def bundle(self) -> Union[tuple, None]:
+        """Return (bundle path, name in bundle) of this asset"""
+        prefix = self._data_prefix
+        path = self._path.lstrip('/')
+        if prefix is None:
+            prefix, _, path = path.partition('/')
+        root = getpath()
+        if root[-1] != '/':
+            root += '/'
+        return root+'data/'+prefix+'.bundle', bundle_key(path)
+
+    def read_compiled(self) -> Any:
+        """Load this compiled asset, from its bundle. Its own file is loaded instead when it's not
+        bundled or when it was saved after the bundle was compiled."""
+        path, name = self.bundle()
+        own = self.read_path()
+        save_writer.wait(own)
+        try:
+            saved = stat(own).st_mtime_ns
+        except OSError:
+            saved = None
+        if path in AssetBundle._opened or exists(path):
+            bundle = AssetBundle.open(path)
+            if name in bundle and (saved is None or saved < bundle.mtime):
+                return bundle.get(name)
+        with open(own, 'rb') as f:
+            return load_state(f.read())
 
 
 def getpath():
-    """Return the App configuration/saved path (not in where this program is found... unless...)"""
-    nf = 0
+    """Return the App configuration/saved path (not in where this program is found... unless...)
+    The result is cached; see invalidate_paths()"""
+    global _root_path
+    if _root_path is None:
+        _root_path = _getpath()
+    return _root_path
+
+
+def _getpath():
     file_dir = realpath(__file__+'/../')
     if system() == 'Linux':
         if not exists(expanduser("~/.config/RPGSample")):
@@ -598,6 +795,43 @@ def load_data(obj: Union[str, bytes], **kwargs):
     return a.copy()
 
 
+def load(path: str) -> Dict[str, Any]:
+    """Load a .yaml or .ini data file. ini defaults are put in 'DEFAULTS'."""
+    ext = splitext(path)[1]
+    save_writer.wait(path)
+    with open(path) as f:
+        if ext == '.yaml':
+            if _yaml is None:
+                raise OperationFailed("PyYAML is required to load yaml files")
+            return _yaml.safe_load(f)
+        if ext == '.ini':
+            self = ConfigParser()
+            self.read_file(f)
+            defaults = self.defaults()
+            a: Dict[str, Any] = {'DEFAULTS': dict(defaults)}
+            for i in self.sections():
+                a[i] = {k: v for k, v in self[i].items() if k not in defaults}
+            return a
+    raise OperationFailed(f"Unrecognized extention: {ext[1:]}")
+
+
+def parse(obj: Union[Mapping[str, Any], ConfigParser], format: Literal['yaml', 'ini']) -> str:
+    """Write data (see load()) into a string of format"""
+    if format == 'yaml':
+        if _yaml is None:
+            raise OperationFailed("PyYAML is required to write yaml files")
+        return _yaml.safe_dump(dict(obj))
+    if format == 'ini':
+        if not isinstance(obj, ConfigParser):
+            parser = ConfigParser()
+            parser.read_dict(obj)
+            obj = parser
+        data = StringIO()
+        obj.write(data)
+        return data.getvalue()
+    raise OperationFailed(f"Unrecognized format: {format}")
+
+
 def _main():
     const0 = ConstCreator("CONST", 10)
     p0 = percentage(50)
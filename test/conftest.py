@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    """A fresh App configuration path (under a temporary HOME); return it."""
+    from libsavestate import AssetBundle, save_writer
+    from libshared import invalidate_paths
+    monkeypatch.setenv('HOME', str(tmp_path))
+    path = tmp_path / ('.config/RPGSample' if sys.platform.startswith('linux') else '.RPGSample')
+    path.mkdir(parents=True)
+    invalidate_paths()
+    yield path
+    save_writer.flush()
+    AssetBundle.forget()
+    invalidate_paths()
+
+
+@pytest.fixture
+def potion():
+    """A stackable item (99 per slot)"""
+    from libitems import ItemType
+    return ItemType('potion', 'consumable', {'heal': 10}, 99)
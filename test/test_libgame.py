@@ -0,0 +1,138 @@
+import pytest
+
+from libchara import Character
+from libgame import Profile, ProfilePath, _pack_records, award_exp
+from libinventory import FixedSizeArray, Inventory
+from liblvman import default_manager
+from libsavestate import SaveCodec, save_writer
+
+
+
+def _new_profile(potion):
+    inventory = Inventory('main', 10)
+    inventory.extend_inventory(FixedSizeArray(10, True))
+    inventory.add(potion, 120)
+    inventory.add('Sword')
+    return Profile(Character('Hero', 'None', 'None', 20), inventory)
+
+
+@pytest.fixture
+def path(root):
+    (root/'profile').mkdir()
+    return ProfilePath('profile://test.profile')
+
+
+def _same(a: Profile, b: Profile):
+    assert dict(a._state) == dict(b._state)
+    assert a._chara == b._chara
+    assert list(map(repr, a.inventory)) == list(map(repr, b.inventory))
+
+
+def _journal(path):
+    save_writer.wait(path.read_path()+'.journal')
+    with open(path.read_path()+'.journal', 'rb') as f:
+        return f.read()
+
+
+def test_profile_round_trip(potion):
+    profile = _new_profile(potion)
+    profile._state['level'] = 3
+    _same(SaveCodec.unload(SaveCodec.dumps(profile)), profile)
+
+
+def test_saves_after_snapshot_go_to_journal(path, potion):
+    profile = _new_profile(potion)
+    path.save(profile)
+    assert path.save(profile) == 0
+    profile._state['exp'] = 7
+    profile._chara.age = 21
+    profile.inventory[15] = 'Shield'
+    size = len(_journal(path))
+    written = path.save(profile)
+    assert 0 < written < len(SaveCodec.dumps(profile))
+    assert len(_journal(path)) == size+written
+    _same(path.read(), profile)
+
+
+def test_journal_is_compacted(path, potion):
+    profile = _new_profile(potion)
+    path.save(profile)
+    for i in range(ProfilePath.compact_every+1):
+        profile._state['exp'] = i
+        path.save(profile)
+    assert profile._journaled < ProfilePath.compact_every
+    _same(path.read(), profile)
+
+
+def test_truncated_journal_record_is_ignored(path, potion):
+    profile = _new_profile(potion)
+    path.save(profile)
+    profile._state['exp'] = 7
+    path.save(profile)
+    save_writer.flush()
+    with open(path.read_path()+'.journal', 'ab') as f:
+        f.write(_pack_records([('state', {'level': 99})])[:-3])
+    loaded = path.read()
+    _same(loaded, profile)
+    # Nothing is appended behind a damaged journal; the next save is a snapshot.
+    loaded._state['exp'] = 8
+    path.save(loaded)
+    assert path.read()._state['exp'] == 8
+
+
+def test_stale_journal_is_ignored(path, potion):
+    profile = _new_profile(potion)
+    path.save(profile)
+    profile._state['exp'] = 7
+    path.save(profile)
+    stale = _journal(path)
+    profile._state['exp'] = 9
+    path.save(profile, full=True)
+    save_writer.flush()
+    # As if the snapshot was written but the journal wasn't reset before a crash
+    with open(path.read_path()+'.journal', 'wb') as f:
+        f.write(stale)
+    assert path.read()._state['exp'] == 9
+
+
+def test_replaced_character_is_saved(path, potion):
+    profile = _new_profile(potion)
+    path.save(profile)
+    profile.set_character(Character('Other', 'None', 'None', 1))
+    path.save(profile)
+    assert path.read()._chara.name == 'Other'
+
+
+def test_stale_profile_does_not_append_to_another_snapshot(path, potion):
+    old = _new_profile(potion)
+    path.save(old)
+    new = Profile(Character('New', 'None', 'None', 1), Inventory('main', 10))
+    path.save(new)
+    old._state['level'] = 99
+    path.save(old)
+    _same(path.read(), old)
+
+
+def test_profiles_read_from_one_save_dont_mix(path, potion):
+    path.save(_new_profile(potion))
+    a, b = path.read(), path.read()
+    a.inventory[15] = 'Shield'
+    path.save(a)
+    b._state['level'] = 2
+    path.save(b)
+    _same(path.read(), b)
+
+
+def test_award_exp_updates_profiles(path, potion):
+    a, b = _new_profile(potion), _new_profile(potion)
+    a._state['exp'] = 5
+    path.save(a)
+    ProfilePath('profile://other.profile').save(b)
+    manager = default_manager()
+    result = award_exp([a, b], [manager.total_exp(3), 0])
+    assert list(result.level_ups) == [3, 0]
+    assert (a._state['level'], a._state['exp']) == (3, 5)
+    assert a._state.dirty and not b._state.dirty
+    assert all(type(a._state[key]) is int for key in ('level', 'exp'))
+    path.save(a)
+    assert path.read()._state['level'] == 3
@@ -0,0 +1,195 @@
+import pytest
+
+from libinventory import FixedSizeArray, FullyAllocatedException, Inventory, ItemRegistry, Stack, null
+from libitems import ItemType
+
+
+
+def _sword(enchant):
+    return ItemType('sword', 'weapon', {'ench': enchant})
+
+
+def test_add_many_keeps_every_unstackable_item(potion):
+    inventory = Inventory('test', 10)
+    fire, ice = _sword('fire'), _sword('ice')
+    assert inventory.add_many([fire, potion, ice]) == [0, 1, 2]
+    assert inventory[0] is fire
+    assert inventory[2] is ice
+    assert inventory[1].count == 1
+
+
+def test_add_many_merges_stackable_items(potion):
+    inventory = Inventory('test', 10)
+    assert inventory.add_many([potion, potion, _sword('fire')]) == [0, 0, 1]
+    assert inventory[0].count == 2
+
+
+def test_add_many_puts_nothing_when_full(potion):
+    inventory = Inventory('test', 2)
+    with pytest.raises(FullyAllocatedException):
+        inventory.add_many([_sword('a'), potion, _sword('b')])
+    assert list(inventory) == [null, null]
+
+
+@pytest.mark.parametrize('stackable', [False, True])
+def test_add_rejects_non_positive_count(stackable, potion):
+    item = potion if stackable else 'Sword'
+    inventory = Inventory('test', 2)
+    with pytest.raises(ValueError):
+        inventory.add(item, 0)
+    assert list(inventory) == [null, null]
+
+
+def test_add_splits_stacks(potion):
+    inventory = Inventory('test', 5)
+    inventory.add(potion, 150)
+    assert [s.count for s in inventory.iter_occupied()] == [99, 51]
+    assert isinstance(inventory[0], Stack)
+
+
+def test_transfer_moves_repeated_slot_once():
+    a, b = Inventory('a', 5), Inventory('b', 5)
+    a.add_many(['Sword', 'Shield'])
+    assert a.transfer(b, [0, 0, 1, -5]) == [0, 1]
+    assert list(b.iter_occupied()) == ['Sword', 'Shield']
+    assert list(a.iter_occupied()) == []
+
+
+def test_transfer_tracks_moved_stacks(potion):
+    a, b = Inventory('a', 5), Inventory('b', 5)
+    a.add(potion, 10)
+    a.transfer(b, [0])
+    b.add(potion, 5)
+    assert [s.count for s in b.iter_occupied()] == [15]
+
+
+def _typed_inventory():
+    """2 untyped slots, then a typed block of 4"""
+    inventory = Inventory('typed', 2)
+    inventory.extend_inventory(FixedSizeArray(4, True, ItemRegistry()))
+    return inventory
+
+
+def test_stacks_skip_typed_blocks(potion):
+    inventory = _typed_inventory()
+    inventory.add_many(['Sword', 'Shield'])
+    with pytest.raises(FullyAllocatedException):
+        inventory.add(potion, 5)
+    assert list(inventory.iter_occupied()) == ['Sword', 'Shield']
+    inventory.pop(1)
+    assert inventory.add(potion, 5) == 1
+    assert inventory[1].count == 5
+
+
+def test_add_many_keeps_untyped_slots_for_stacks(potion):
+    inventory = _typed_inventory()
+    assert inventory.add_many(['Sword', potion, 'Shield']) == [1, 0, 2]
+    assert isinstance(inventory[0], Stack)
+
+
+def test_sort_and_compact_with_typed_blocks(potion):
+    inventory = _typed_inventory()
+    inventory[3] = 'Sword'
+    inventory[4] = 'Shield'
+    inventory.add(potion, 5)
+    # Items first would put them all in the untyped block; the stack keeps its slot there
+    inventory.sort(key=lambda data: isinstance(data, Stack))
+    items = list(inventory.iter_occupied())
+    assert [data for data in items if not isinstance(data, Stack)] == ['Sword', 'Shield']
+    assert [data.count for data in items if isinstance(data, Stack)] == [5]
+    assert isinstance(inventory[0], Stack) or isinstance(inventory[1], Stack)
+    inventory.compact()
+    assert len(list(inventory.iter_occupied())) == 3
+
+
+def test_pack_fails_before_writing(potion):
+    inventory = _typed_inventory()
+    inventory[2] = 'Sword'
+    before = list(inventory)
+    with pytest.raises(FullyAllocatedException):
+        inventory._array_list._pack([Stack(potion, 1) for _ in range(3)])
+    assert list(inventory) == before
+
+
+def test_bulk_set_rejects_stack_in_typed_block(potion):
+    inventory = _typed_inventory()
+    with pytest.raises(TypeError):
+        inventory.bulk_set({0: 'Sword', 3: Stack(potion, 2)})
+    assert list(inventory) == [null]*6
+
+
+def test_inventory_round_trip(potion):
+    from libsavestate import SaveCodec
+    inventory = _typed_inventory()
+    inventory.add(potion, 120)
+    inventory[4] = 'Sword'
+    inventory.extend_inventory(FixedSizeArray(3, True))
+    inventory.detach_inventory(2)
+    loaded = SaveCodec.unload(SaveCodec.dumps(inventory))
+    assert list(map(repr, loaded)) == list(map(repr, inventory))
+    assert loaded._array_list[1].registry is not None
+    loaded.add(potion, 10)
+    assert [s.count for s in loaded.iter_occupied() if isinstance(s, Stack)] == [99, 31]
+
+
+def test_stack_round_trip(potion):
+    from libsavestate import SaveCodec
+    stack = SaveCodec.unload(SaveCodec.dumps(Stack(potion, 5)))
+    assert (stack.item, stack.count) == (potion, 5)
+
+
+def _same_key_swords(indexed, typed=False):
+    inventory = Inventory('test', 3, indexed=indexed)
+    if typed:
+        inventory.extend_inventory(FixedSizeArray(3, True, ItemRegistry()))
+    a, b = ItemType('sword', 'w', {'atk': 1}), ItemType('sword', 'w', {'atk': 9})
+    inventory[3 if typed else 1] = a
+    return inventory, a, b
+
+
+@pytest.mark.parametrize('typed', [False, True])
+def test_index_does_not_change_matches(typed):
+    results = []
+    for indexed in (False, True):
+        inventory, a, b = _same_key_swords(indexed, typed)
+        result = [b in inventory, inventory.count(b), inventory.find_all(b),
+                  a in inventory, inventory.count(a), inventory.find_all(a)]
+        inventory.remove(b)
+        result.append(list(inventory.iter_occupied()))
+        results.append(result)
+    assert results[0] == results[1]
+    assert results[0] == [False, 0, [], True, 1, [3 if typed else 1], [a]]
+
+
+@pytest.mark.parametrize('indexed', [False, True])
+def test_stacks_are_found_in_every_block(indexed, potion):
+    inventory = Inventory('test', 3, indexed=indexed)
+    inventory.extend_inventory(FixedSizeArray(3, True))
+    inventory.add_many(['Sword', 'Shield', 'Bow', 'Axe'])
+    inventory.add(potion, 150)
+    assert potion in inventory
+    assert inventory.count(potion) == 150
+    assert inventory.find_all(potion) == [4, 5]
+    inventory.remove(potion, 100)
+    assert [s.count for s in inventory.iter_occupied() if isinstance(s, Stack)] == [50]
+
+
+def test_transfer_keeps_stacks_that_dont_fit(potion):
+    a = Inventory('a', 5)
+    a.add(potion, 250)
+    b = Inventory('b', 1)
+    b.extend_inventory(FixedSizeArray(5, True, ItemRegistry()))
+    with pytest.raises(FullyAllocatedException):
+        a.transfer(b, [0, 1, 2])
+    assert [s.count for s in a.iter_occupied()] == [99, 99, 52]
+    assert list(b.iter_occupied()) == []
+
+
+@pytest.mark.parametrize('method', ['compact', 'sort'])
+def test_pack_right_after_extending(method):
+    inventory = Inventory('test', 5)
+    inventory.add_many(['Sword', 'Shield'])
+    inventory.pop(0)
+    inventory.extend_inventory(FixedSizeArray(3, True))
+    getattr(inventory, method)()
+    assert list(inventory) == ['Shield']+[null]*7
@@ -0,0 +1,164 @@
+import os
+
+import pytest
+
+import liblocalisation
+from liblocalisation import LCPath, Localisation, undefined
+from libsavestate import AssetBundle
+
+_en = """Lines not starting with @ are comments.
+@main $0 RPGSample
+@main #Confirmation Are you  sure?
+@main #Cancel Cancel
+@menu #Start Start a new game
+"""
+
+
+@pytest.fixture
+def locales(root, monkeypatch):
+    """The locale directory; opened locales are dropped after the test."""
+    path = root/'data/locale'
+    path.mkdir(parents=True)
+    monkeypatch.setattr(liblocalisation, '_current_locale', 'en')
+    yield path
+    for name in list(liblocalisation._locales):
+        Localisation.unload_locale(name)
+
+
+def _write(locales, name, text, mtime=None):
+    path = LCPath(f'locale://{name}').read_path()
+    with open(path, 'w') as f:
+        f.write(text)
+    if mtime is not None:
+        os.utime(path, ns=(mtime, mtime))
+
+
+def test_reader_keeps_whole_values(locales):
+    _write(locales, 'en', _en)
+    texts = LCPath('locale://en').read()
+    assert texts == {'main': {0: 'RPGSample', 'Confirmation': 'Are you  sure?', 'Cancel': 'Cancel'},
+                     'menu': {'Start': 'Start a new game'}}
+
+
+def test_reader_refuses_short_lines_and_bad_numbers(locales):
+    for text in ("@main #OK\n", "@main $x Oops\n"):
+        _write(locales, 'en', text)
+        with pytest.raises(Exception):
+            LCPath('locale://en').read()
+
+
+def test_locale_is_compiled_once(locales):
+    _write(locales, 'en', _en)
+    path = LCPath('locale://en')
+    assert isinstance(path.open(), AssetBundle)
+    compiled = locales/'en.localec'
+    assert LCPath('locale://en').compiled_path() == str(compiled)
+    written = compiled.stat().st_mtime_ns
+    AssetBundle.forget()
+    assert isinstance(path.open(), AssetBundle)
+    assert compiled.stat().st_mtime_ns == written
+    assert path.read()['main'][0] == 'RPGSample'
+
+
+def test_locale_is_recompiled_after_source_changes(locales):
+    _write(locales, 'en', _en, mtime=10**18)
+    assert LCPath('locale://en').read()['main']['Cancel'] == 'Cancel'
+    _write(locales, 'en', _en.replace('#Cancel Cancel', '#Cancel Back out'), mtime=2*10**18)
+    assert LCPath('locale://en').read()['main']['Cancel'] == 'Back out'
+
+
+@pytest.mark.parametrize('data', [b'', b'RPGB', b'junk'*10, None])
+def test_unreadable_compiled_locale_is_replaced(locales, data):
+    _write(locales, 'en', _en)
+    path = LCPath('locale://en')
+    path.open()
+    AssetBundle.forget()
+    compiled = locales/'en.localec'
+    compiled.write_bytes(compiled.read_bytes()[:30] if data is None else data)
+    assert path.read()['menu']['Start'] == 'Start a new game'
+    assert isinstance(path.open(), AssetBundle)
+
+
+def test_namespaces_are_loaded_lazily_and_evicted(locales, monkeypatch):
+    monkeypatch.setattr(liblocalisation, 'namespace_limit', 2)
+    _write(locales, 'en', ''.join(f"@ns{i} #Name Text {i}\n" for i in range(4)))
+    localisation = Localisation.load_locale('en')
+    assert list(liblocalisation._namespaces) == []
+    assert localisation.get_text('ns0', 'Name') == 'Text 0'
+    assert list(liblocalisation._namespaces) == [('en', 'ns0')]
+    localisation.get_text('ns1', 'Name')
+    localisation.get_text('ns0', 'Name')  # Now the most recently used
+    localisation.get_text('ns2', 'Name')
+    assert list(liblocalisation._namespaces) == [('en', 'ns0'), ('en', 'ns2')]
+    assert localisation.get_text('ns1', 'Name') == 'Text 1'
+    assert list(liblocalisation._namespaces) == [('en', 'ns2'), ('en', 'ns1')]
+    assert localisation.get_text('missing', 'Name') is undefined
+
+
+def test_unloaded_locale_is_reopened(locales):
+    _write(locales, 'en', _en, mtime=10**18)
+    localisation = Localisation.load_locale('en')
+    assert localisation.get_text('main', 'Cancel') == 'Cancel'
+    compiled = LCPath('locale://en').compiled_path()
+    assert compiled in AssetBundle._opened
+    Localisation.unload_locale('en')
+    assert 'en' not in liblocalisation._locales
+    assert all(key[0] != 'en' for key in liblocalisation._namespaces)
+    assert compiled not in AssetBundle._opened
+    _write(locales, 'en', _en.replace('#Cancel Cancel', '#Cancel Back out'), mtime=2*10**18)
+    assert localisation.get_text('main', 'Cancel') == 'Back out'
+
+
+_formats = """@main #Percent 100% done, {name}; %(name)s stays
+@main #Spec {count:>3} left
+@main #Conversion Hello {name!r}
+@main #Index First {items[0]}
+"""
+
+
+def test_format_text(locales):
+    _write(locales, 'en', _formats)
+    assert liblocalisation.format_text('main', 'Percent', name='Bob') == '100% done, Bob; %(name)s stays'
+    assert liblocalisation.format_text('main', 'Spec', count=7) == '  7 left'
+    assert liblocalisation.format_text('main', 'Conversion', name='Bob') == "Hello 'Bob'"
+    assert liblocalisation.format_text('main', 'Index', items=['a']) == 'First a'
+    assert liblocalisation.format_text('main', 'Missing') is undefined
+    localisation = Localisation('en')
+    assert localisation.format_text('main', 'Spec', count=12) == ' 12 left'
+    namespace = localisation.bind_namespace('main')
+    assert namespace.format_text('Percent', name='Ann') == '100% done, Ann; %(name)s stays'
+    assert namespace.format_text('Spec', count=1) == '  1 left'
+    with pytest.raises(KeyError):
+        namespace.format_text('Percent')
+
+
+def test_get_texts(locales):
+    _write(locales, 'en', _en)
+    expected = ['RPGSample', 'Cancel', undefined]
+    assert liblocalisation.get_texts('main', [0, 'Cancel', 'Missing']) == expected
+    assert Localisation('en').get_texts('main', [0, 'Cancel', 'Missing']) == expected
+    assert liblocalisation.bind_namespace('main').get_texts([0, 'Cancel', 'Missing']) == expected
+
+
+def test_bound_namespace_follows_locale(locales):
+    _write(locales, 'en', _en)
+    _write(locales, 'id', "@main #Cancel Batal\n", mtime=10**18)
+    namespace = Localisation('en').bind_namespace('main')
+    assert namespace['Cancel'] == 'Cancel'
+    Localisation.set_locale('id')
+    assert namespace['Cancel'] == 'Batal'
+    assert namespace[0] is undefined
+    _write(locales, 'id', "@main #Cancel Kembali\n", mtime=2*10**18)
+    assert namespace['Cancel'] == 'Batal'
+    Localisation.unload_locale('id')
+    assert namespace['Cancel'] == 'Kembali'
+    Localisation.set_locale('en')
+    assert namespace.get_text('Cancel') == 'Cancel'
+
+
+def test_bound_namespace_without_locale_or_fallback(locales, monkeypatch):
+    monkeypatch.setattr(liblocalisation, '_current_locale', 'xx')
+    with pytest.raises(liblocalisation.LocalisationError):
+        liblocalisation.bind_namespace('main')['Cancel']
+    _write(locales, 'en', _en)
+    assert Localisation('en').bind_namespace('main')['Cancel'] == 'Cancel'
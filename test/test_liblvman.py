@@ -0,0 +1,64 @@
+import pytest
+
+from liblvman import EXP_LIMIT, LevelManager
+
+
+def test_level_curve_stops_before_saturation():
+    manager = LevelManager()
+    last = manager.max_level-1
+    assert manager.total_exp(last) < EXP_LIMIT
+    assert manager.level_for_exp(EXP_LIMIT) == last
+    result = manager.award([last], [0], [EXP_LIMIT], use_numpy=False)
+    assert list(result.levels) == [last]
+    assert 0 <= result.exp[0] <= manager.exp_for_level(last)
+
+
+def test_same_seed_makes_same_curve():
+    a, b = LevelManager(7), LevelManager(7)
+    assert [a.exp_for_level(n) for n in range(0, a.max_level, 50)] == \
+        [b.exp_for_level(n) for n in range(0, b.max_level, 50)]
+    assert LevelManager(7).exp_for_level(100) != LevelManager(8).exp_for_level(100)
+
+
+def test_level_for_exp_bounds():
+    manager = LevelManager()
+    assert manager.level_for_exp(0) == 0
+    assert manager.level_for_exp(manager.total_exp(42)) == 42
+    assert manager.level_for_exp(manager.total_exp(42)-1) == 41
+    with pytest.raises(ValueError):
+        manager.level_for_exp(-1)
+    with pytest.raises(ValueError):
+        manager.total_exp(manager.max_level)
+
+
+def test_award_levels_up():
+    manager = LevelManager()
+    result = manager.award([0, 3, 7], [0, 10, 0], [manager.total_exp(5), 0, 1], use_numpy=False)
+    assert list(result.levels) == [5, 3, 7]
+    assert list(result.exp) == [0, 10, 1]
+    assert list(result.level_ups) == [5, 0, 0]
+    with pytest.raises(ValueError):
+        manager.award([0], [0, 1], [0], use_numpy=False)
+    with pytest.raises(ValueError):
+        manager.award([manager.max_level], [0], [0], use_numpy=False)
+
+
+@pytest.mark.parametrize('exp, gains', [([-1000], [0]), ([0], [-1])])
+def test_award_rejects_negative_exp(exp, gains):
+    with pytest.raises(ValueError):
+        LevelManager().award([5], exp, gains, use_numpy=False)
+
+
+def test_award_numpy_matches_array():
+    np = pytest.importorskip('numpy')
+    manager = LevelManager()
+    last = manager.max_level-1
+    levels, exp, gains = [0, 3, 42, last, 10], [0, 10, 5, 0, 7], [manager.total_exp(5), 0, 10**9, EXP_LIMIT, 1]
+    expected = manager.award(levels, exp, gains, use_numpy=False)
+    result = manager.award(levels, exp, gains, use_numpy=True)
+    for a, b in zip(result, expected):
+        assert isinstance(a, np.ndarray)
+        assert a.tolist() == b.tolist()
+    assert [list(a) for a in manager.award([], [], [], use_numpy=True)] == [[], [], []]
+    with pytest.raises(ValueError):
+        manager.award([5], [-1000], [0], use_numpy=True)
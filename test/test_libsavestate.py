@@ -0,0 +1,124 @@
+import pytest
+
+import libchara  # noqa: F401; registers Character
+from libchara import Character
+from pickle import UnpicklingError
+
+from libsavestate import (AssetBundle, BundleError, CodecError, SaveCodec, SaveWriter, _max_depth,
+                          load_state)
+
+
+def _nested(depth):
+    data = []
+    for _ in range(depth):
+        data = [data]
+    return data
+
+
+@pytest.mark.parametrize('value', [None, True, False, 0, -1, 2**70, -2**70, 1.5, 'text', 'ü'*200,
+                                   b'\x00raw', [1, [2, (3, 'a')]], {'a': {1: None}}, (), _nested(_max_depth)])
+def test_plain_round_trip(value):
+    assert SaveCodec.unload(SaveCodec.dumps(value)) == value
+
+
+def test_shared_objects_are_encoded_once():
+    chara = Character('Name', 'None', 'None', 1)
+    a, b = SaveCodec.unload(SaveCodec.dumps([chara, chara]))
+    assert a is b and a == chara
+
+
+@pytest.mark.parametrize('data', [
+    b'RPGS\x01d\x01l\x00i\x00',        # unhashable dict key
+    b'RPGS\x01o\x0a\x01s\x01a',        # wrong field count of Character
+    b'RPGS\x01o\x7f\x00',              # unknown tag
+    b'RPGS\x01s\x05ab',                # truncated string
+    b'RPGS\x01s\x02\xff\xfe',          # bad UTF-8
+    b'RPGS\x01r\x00',                  # reference to nothing
+    b'RPGS\x01i\x00i\x00',             # trailing data
+    b'RPGS\x01',                       # no value
+    b'RPGS\x01' + b'l\x01'*5000 + b'N',  # nested too deep
+])
+def test_malformed_data_raises_codec_error(data):
+    with pytest.raises(CodecError):
+        SaveCodec.unload(data)
+
+
+def test_encoding_refuses_deep_and_unknown_data():
+    with pytest.raises(CodecError):
+        SaveCodec.dumps(_nested(_max_depth+5))
+    with pytest.raises(CodecError):
+        SaveCodec.dumps(object())
+
+
+def test_failed_write_only_fails_its_own_path(tmp_path):
+    writer = SaveWriter()
+    bad, good = str(tmp_path/'missing'/'save'), str(tmp_path/'save')
+    writer.write(bad, b'lost')
+    with pytest.raises(OSError):
+        writer.wait(bad)
+    writer.write(bad, b'lost again')
+    assert writer.write(good, b'kept') == 4
+    writer.wait(good)
+    assert (tmp_path/'save').read_bytes() == b'kept'
+    with pytest.raises(OSError):
+        writer.flush()
+    writer.flush()
+
+
+def test_writes_are_coalesced_and_appended(tmp_path):
+    writer = SaveWriter()
+    path = str(tmp_path/'save')
+    writer.write(path, b'old')
+    writer.write(path, 'new')
+    writer.write(path, b'+1', append=True)
+    writer.wait(path)
+    writer.write(path, b'+2', append=True)
+    writer.flush()
+    assert (tmp_path/'save').read_bytes() == b'new+1+2'
+
+
+def test_bundle_round_trip(tmp_path):
+    path = str(tmp_path/'items.bundle')
+    AssetBundle.write(path, {'a': [1, 2], 'b/c': 'text'})
+    bundle = AssetBundle(path)
+    assert (bundle.get('a'), bundle.get('b/c')) == ([1, 2], 'text')
+    assert 'x' not in bundle
+    with pytest.raises(BundleError):
+        bundle.get('x')
+    bundle.close()
+
+
+def test_truncated_or_corrupt_bundle_raises_bundle_error(tmp_path):
+    path = tmp_path/'items.bundle'
+    AssetBundle.write(str(path), {'a': [1, 2], 'b/c': 'text'})
+    data = path.read_bytes()
+    for cut in range(len(data)):
+        path.write_bytes(data[:cut])
+        with pytest.raises(BundleError):
+            AssetBundle(str(path))
+    name = data.index(b'b/c')
+    path.write_bytes(data[:name]+b'\xff'+data[name+1:])
+    with pytest.raises(BundleError):
+        AssetBundle(str(path))
+    path.write_bytes(data[:-4]+b'\xff'*4)
+    bundle = AssetBundle(str(path))
+    with pytest.raises(BundleError):
+        bundle.get('b/c')
+    bundle.close()
+
+
+def test_load_state_reads_old_character_pickle():
+    # Saved by the pickle-based CharaPath
+    data = (b'\x80\x04\x95R\x00\x00\x00\x00\x00\x00\x00\x8c\x08libchara\x94\x8c\tCharacter\x94\x93\x94)'
+            b'\x81\x94}\x94(\x8c\x04name\x94\x8c\x04Hero\x94\x8c\x06gender\x94\x8c\x01f\x94\x8c\x04race'
+            b'\x94\x8c\x03elf\x94\x8c\x03age\x94K\x14ub.')
+    chara = load_state(data)
+    assert isinstance(chara, Character)
+    assert (chara.name, chara.race, chara.age) == ('Hero', 'elf', 20)
+
+
+@pytest.mark.parametrize('name', [b'Inventory', b'FixedSizeArray'])
+def test_load_state_refuses_inventory_pickle(name):
+    data = b'\x80\x04\x8c\x0clibinventory\x94\x8c' + bytes([len(name)]) + name + b'\x94\x93\x94.'
+    with pytest.raises(UnpicklingError):
+        load_state(data)
@@ -0,0 +1,71 @@
+import sys
+
+from libitems import ItemPath, ItemType
+from libsavestate import compile_data
+from libshared import PUID, DataPath, Protocol, _parse_url, getpath, invalidate_paths
+
+
+def test_puid_hash_matches_equality():
+    puid = PUID(12345, version='int0')
+    assert puid != 12345
+    assert puid.as_int == 12345
+    assert {str(puid): 1}.get(puid) == 1
+    assert {PUID(12345, version='int0'): 1}[puid] == 1
+    assert hash(puid) == hash(str(puid))
+
+
+def test_compiled_save_is_read_over_bundle(root):
+    (root/'data-source/items/w').mkdir(parents=True)
+    (root/'data/items/w').mkdir(parents=True)
+    ItemPath('items://w/pot.ini').save(ItemType('pot', 'w', {'hp': '5'}))
+    compile_data(('items',))
+    compiled = ItemPath('items://w/pot.itm?compiled=true')
+    assert compiled.read().speciality['hp'] == '5'
+    compiled.save(ItemType('pot', 'w', {'hp': 999}))
+    assert compiled.read().speciality['hp'] == 999
+
+
+def test_paths_are_cached_until_invalidated(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    invalidate_paths()
+    try:
+        url = 'data://items/w/pot.ini'
+        before = DataPath(url).read_path()
+        assert before == getpath()+'/data-source/items/w/pot.ini'
+        config = tmp_path / ('.config/RPGSample' if sys.platform.startswith('linux') else '.RPGSample')
+        config.mkdir(parents=True)
+        # Still the cached resolution; the new directory isn't looked at
+        assert DataPath(url).read_path() == before
+        assert Protocol.resolve_many([url, url]) == [before, before]
+        invalidate_paths()
+        after = str(config/'data-source/items/w/pot.ini')
+        assert Protocol.resolve_many([url]) == [after]
+        assert DataPath(url).read_path() == after
+    finally:
+        invalidate_paths()
+
+
+def test_parse_url():
+    parsed = _parse_url('data://items/a.ini?compiled=yes&n=1&n=2#top')
+    assert (parsed.scheme, parsed.path) == ('data', 'items/a.ini')
+    assert dict(parsed.config) == {'compiled': True, 'n': (1, 2)}
+
+
+def test_from_parts_matches_url(root):
+    made = Protocol.from_parts('data', 'items/a.ini', {'compiled': True, 'n': [1, 2]})
+    parsed = Protocol(str(made))
+    assert type(made) is DataPath and str(made) == 'data://items/a.ini?compiled=true&n=1&n=2'
+    assert dict(made.config.items()) == dict(parsed.config.items()) == {'compiled': True, 'n': (1, 2)}
+    assert made.read_path() == parsed.read_path() == str(root/'data/items/a.ini')
+
+
+def test_from_parts_path_with_query_chars(root):
+    for first in (True, False):
+        invalidate_paths()
+        made = Protocol.from_parts('data', 'items/a?b#c.ini')
+        parsed = Protocol(str(made))
+        if first:
+            made.read_path()
+        assert made.read_path() == str(root/'data-source/items/a?b#c.ini')
+        assert parsed.read_path() == str(root/'data-source/items/a')
+        assert Protocol.resolve_many([str(made)]) == [parsed.read_path()]